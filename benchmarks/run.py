@@ -0,0 +1,308 @@
+"""
+Benchmarks for the commonIOT hot paths, results are printed as json
+
+    python benchmarks/run.py --devices 500 --output results.json
+
+compare two result files, eg. from two versions of the plugin
+
+    python benchmarks/run.py --compare old.json new.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+from ovos_utils.messagebus import Message
+
+from ovos_PHAL_plugin_commonIOT.device_manager import CommonIOTDeviceManager
+from ovos_PHAL_plugin_commonIOT.metrics import METRICS
+from ovos_PHAL_plugin_commonIOT.opm.base import IOTScanEvent
+from ovos_PHAL_plugin_commonIOT.opm.transitions import ColorTransition
+from ovos_PHAL_plugin_commonIOT.replay import ReplayScanner
+from ovos_PHAL_plugin_commonIOT.version import VERSION_MAJOR, VERSION_MINOR, \
+    VERSION_BUILD, VERSION_ALPHA
+from synthetic import SyntheticScanner, BenchmarkBus
+
+
+def quiet():
+    # silence anything a device or plugin prints
+    return contextlib.redirect_stdout(io.StringIO())
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def make_setup(args, **config):
+    bus = BenchmarkBus()
+    manager = CommonIOTDeviceManager(bus, {"persist_devices": False})
+    config = dict({"devices": args.devices,
+                   "duplicate_hosts": args.duplicate_hosts,
+                   "seed": args.seed}, **config)
+    scanner = SyntheticScanner(bus, config=config,
+                               new_device_callback=manager.on_new_device,
+                               lost_device_callback=manager.on_device_lost)
+    return bus, manager, scanner
+
+
+def bench_discovery(args):
+    """ devices per second through handle_scan_results into the manager"""
+    _, manager, scanner = make_setup(args)
+    devices = scanner.scan()
+    with quiet():
+        start = time.perf_counter()
+        scanner.handle_scan_results(devices)
+        elapsed = time.perf_counter() - start
+    return {"seconds": elapsed,
+            "devices_per_second": len(devices) / elapsed,
+            "known_devices": len(manager.devices)}
+
+
+def bench_scan_cycle(args):
+    """ cpu time of a steady state scan cycle with churn"""
+    _, manager, scanner = make_setup(args, churn=args.churn, ttl=args.ttl)
+    cpu = []
+    with quiet():
+        for _ in range(args.cycles):
+            devices = scanner.scan()
+            start = time.process_time()
+            scanner.handle_scan_results(devices)
+            scanner.check_lost_devices()
+            cpu.append(time.process_time() - start)
+            time.sleep(args.cycle_interval)
+    return {"cycles": len(cpu),
+            "cpu_ms_mean": statistics.mean(cpu) * 1000,
+            "cpu_ms_p95": percentile(cpu, 95) * 1000,
+            "known_devices": len(manager.devices)}
+
+
+def bench_loss_latency(args):
+    """ delay between a device expiring and the lost callback"""
+    _, manager, scanner = make_setup(args, ttl=args.ttl)
+    latencies = []
+
+    def on_lost(device):
+        expected = device.last_seen + scanner.ttl
+        latencies.append(time.time() - expected)
+        manager.on_device_lost(device)
+
+    scanner.lost_device_callback = on_lost
+    with quiet():
+        # devices are seen once in batches, then never again
+        for _ in range(5):
+            scanner.handle_scan_results(scanner.scan())
+            scanner.step()
+            time.sleep(scanner.ttl / 5)
+        while scanner.timestamps:
+            scanner.check_lost_devices()
+            if scanner.next_expiry:
+                time.sleep(max(0.0, scanner.next_expiry - time.time()))
+    return {"lost_devices": len(latencies),
+            "latency_ms_mean": statistics.mean(latencies) * 1000,
+            "latency_ms_max": max(latencies) * 1000}
+
+
+def bench_push(args):
+    """ discovery latency of pushed device events through the scan scheduler"""
+    _, manager, scanner = make_setup(args, ttl=60, time_between_checks=3600)
+    scheduler = manager.scheduler
+    scheduler.start()
+    scheduler.add_scanner("synthetic", scanner)
+    time.sleep(0.1)  # first scan of the fixed population
+    reported = {}
+    latencies = []
+
+    def on_new(device):
+        if device.device_id in reported:
+            latencies.append(time.monotonic() - reported[device.device_id])
+        manager.on_new_device(device)
+
+    scanner.new_device_callback = on_new
+    start = time.perf_counter()
+    with quiet():
+        for idx in range(args.devices + 1, 2 * args.devices + 1):
+            device = scanner.make_device(idx)
+            reported[device.device_id] = time.monotonic()
+            scanner.report_device(IOTScanEvent.ADDED, device, block=True)
+        while len(latencies) < args.devices and time.perf_counter() - start < 10:
+            time.sleep(0.001)
+    elapsed = time.perf_counter() - start
+    scheduler.shutdown()
+    return {"events_per_second": len(latencies) / elapsed,
+            "latency_ms_p50": percentile(latencies, 50) * 1000,
+            "latency_ms_p95": percentile(latencies, 95) * 1000}
+
+
+def bench_memory(args):
+    """ bytes allocated per tracked device, scanner and manager combined"""
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    _, manager, scanner = make_setup(args)
+    with quiet():
+        scanner.handle_scan_results(scanner.scan())
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    allocated = sum(s.size_diff for s in after.compare_to(before, "filename"))
+    return {"bytes_per_device": allocated / len(manager.devices),
+            "total_bytes": allocated}
+
+
+def bench_bus(args):
+    """ ovos.iot.get.devices reply latency, cold and cached snapshot"""
+    bus, manager, scanner = make_setup(args)
+    with quiet():
+        scanner.handle_scan_results(scanner.scan())
+    replies = []
+    bus.on("ovos.iot.get.devices.response", replies.append)
+
+    def request(data):
+        start = time.perf_counter()
+        bus.emit(Message("ovos.iot.get.devices", data))
+        return time.perf_counter() - start
+
+    cold = request({})
+    warm = [request({"page": i % 5}) for i in range(args.requests)]
+    filtered = [request({"area": "room 1"}) for _ in range(args.requests)]
+    return {"cold_ms": cold * 1000,
+            "cached_ms_mean": statistics.mean(warm) * 1000,
+            "filtered_ms_mean": statistics.mean(filtered) * 1000,
+            "replies": len(replies)}
+
+
+def bench_name_lookup(args):
+    """ fuzzy spoken name resolution latency"""
+    _, manager, scanner = make_setup(args)
+    with quiet():
+        scanner.handle_scan_results(scanner.scan())
+    rnd = scanner.random
+    queries = [f"room {i % 10} synthetic device {i}"
+               for i in (rnd.randint(1, args.devices) for _ in range(args.requests))]
+    latencies = []
+    hits = 0
+    for query in queries:
+        start = time.perf_counter()
+        matches = manager.find_devices(query, k=5)
+        latencies.append(time.perf_counter() - start)
+        hits += bool(matches)
+    return {"lookup_ms_mean": statistics.mean(latencies) * 1000,
+            "lookup_ms_p95": percentile(latencies, 95) * 1000,
+            "hits": hits}
+
+
+def bench_transitions(args):
+    """ precomputed color fade frames per second, per curve"""
+    results = {}
+    for curve in ColorTransition.CURVES:
+        start = time.perf_counter()
+        for _ in range(args.requests):
+            ColorTransition((255, 0, 0), (0, 0, 255), frames=100, curve=curve)
+        elapsed = time.perf_counter() - start
+        results[f"{curve}_frames_per_second"] = 100 * args.requests / elapsed
+    return results
+
+
+def bench_replay(args):
+    """ recorded scans replayed into the manager as fast as possible,
+    --replay uses a real recording, otherwise synthetic scan cycles
+    with churn are recorded first"""
+    path = args.replay
+    if not path:
+        path = os.path.join(tempfile.mkdtemp(), "scans.ndjson")
+        _, _, recorder = make_setup(args, churn=args.churn, record_path=path)
+        with quiet():
+            for _ in range(args.cycles):
+                recorder.handle_scan_results(recorder.scan())
+        recorder.recorder.close()
+    bus = BenchmarkBus()
+    manager = CommonIOTDeviceManager(bus, {"persist_devices": False})
+    scanner = ReplayScanner(bus, config={"replay_path": path, "replay_speed": 0,
+                                         "ttl": args.ttl},
+                            new_device_callback=manager.on_new_device,
+                            lost_device_callback=manager.on_device_lost)
+    with quiet():
+        stats = scanner.replay()
+    return {"entries": stats["entries"],
+            "devices_per_second": stats["devices"] / stats["seconds"],
+            "known_devices": len(manager.devices)}
+
+
+BENCHMARKS = {
+    "discovery": bench_discovery,
+    "scan_cycle": bench_scan_cycle,
+    "loss_latency": bench_loss_latency,
+    "push": bench_push,
+    "memory": bench_memory,
+    "bus": bench_bus,
+    "name_lookup": bench_name_lookup,
+    "transitions": bench_transitions,
+    "replay": bench_replay
+}
+
+
+def compare(old_path, new_path):
+    """ new / old ratio for every numeric result present in both files"""
+    with open(old_path) as f:
+        old = json.load(f)["results"]
+    with open(new_path) as f:
+        new = json.load(f)["results"]
+    ratios = {}
+    for bench, values in new.items():
+        for key, value in values.items():
+            prev = old.get(bench, {}).get(key)
+            if isinstance(value, (int, float)) and prev:
+                ratios[f"{bench}.{key}"] = value / prev
+    return ratios
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--devices", type=int, default=500)
+    parser.add_argument("--churn", type=float, default=0.05)
+    parser.add_argument("--duplicate-hosts", type=float, default=0.1)
+    parser.add_argument("--cycles", type=int, default=100)
+    parser.add_argument("--cycle-interval", type=float, default=0.02)
+    parser.add_argument("--ttl", type=float, default=0.5)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--replay", help="scan recording for the replay benchmark")
+    parser.add_argument("--only", nargs="*", choices=list(BENCHMARKS))
+    parser.add_argument("--output", help="write results to this file")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"))
+    args = parser.parse_args()
+
+    if args.compare:
+        print(json.dumps(compare(*args.compare), indent=2))
+        return
+
+    results = {name: bench(args) for name, bench in BENCHMARKS.items()
+               if not args.only or name in args.only}
+    results["metrics"] = {k: h.summary() for k, h in METRICS.histograms.items()
+                          if k.startswith("scanner.synthetic-scanner")}
+    version = f"{VERSION_MAJOR}.{VERSION_MINOR}.{VERSION_BUILD}"
+    if VERSION_ALPHA:
+        version += f"a{VERSION_ALPHA}"
+    report = {
+        "version": version,
+        "python": platform.python_version(),
+        "timestamp": time.time(),
+        "params": {k: v for k, v in vars(args).items()
+                   if k not in ("output", "compare", "only", "replay")},
+        "results": results
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
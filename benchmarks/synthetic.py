@@ -0,0 +1,73 @@
+import random
+import time
+
+from ovos_utils.messagebus import FakeBus
+
+from ovos_PHAL_plugin_commonIOT.opm.base import IOTScannerPlugin, Switch
+
+
+class SyntheticScanner(IOTScannerPlugin):
+    """ fake scanner plugin that reports a configurable device population
+
+    config keys:
+        devices (int): number of visible devices
+        churn (float): fraction of the devices replaced by new ones every scan
+        duplicate_hosts (float): fraction of devices sharing a host with another
+        scan_latency (float): seconds every scan takes
+        seed (int): random seed, runs with the same config are identical
+    """
+
+    def __init__(self, bus=None, name="synthetic-scanner", config=None,
+                 new_device_callback=None, lost_device_callback=None,
+                 aliases=None):
+        super().__init__(bus or FakeBus(), name, config,
+                         new_device_callback, lost_device_callback, aliases)
+        self.n_devices = self.config.get("devices", 100)
+        self.churn = self.config.get("churn", 0.0)
+        self.duplicate_hosts = self.config.get("duplicate_hosts", 0.0)
+        self.scan_latency = self.config.get("scan_latency", 0.0)
+        self.seed = self.config.get("seed", 42)
+        self.random = random.Random(self.seed)
+        self._next_id = 0
+        self.visible = [self._new_id() for _ in range(self.n_devices)]
+
+    def _new_id(self):
+        self._next_id += 1
+        return self._next_id
+
+    def _host(self, idx):
+        # deterministic per device, the host must not change between scans
+        rnd = random.Random(idx * 7919 + self.seed)
+        if rnd.random() < self.duplicate_hosts:
+            # share the host of another device, like a TV seen by lan and upnp
+            idx = rnd.randint(1, max(1, idx))
+        return f"10.{idx // 65536 % 256}.{idx // 256 % 256}.{idx % 256}"
+
+    def make_device(self, idx):
+        return Switch(f"synthetic-{idx}", host=self._host(idx),
+                      name=f"synthetic device {idx}",
+                      area=f"room {idx % 10}")
+
+    def step(self):
+        """ replace churn * devices visible devices by new ones"""
+        for _ in range(int(self.n_devices * self.churn)):
+            self.visible[self.random.randrange(len(self.visible))] = self._new_id()
+
+    def scan(self):
+        if self.scan_latency:
+            time.sleep(self.scan_latency)
+        devices = [self.make_device(idx) for idx in self.visible]
+        self.step()
+        return devices
+
+
+class BenchmarkBus(FakeBus):
+    """ FakeBus that counts emitted messages per type"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.counts = {}
+
+    def emit(self, message):
+        self.counts[message.msg_type] = self.counts.get(message.msg_type, 0) + 1
+        super().emit(message)
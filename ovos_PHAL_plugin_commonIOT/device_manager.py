@@ -1,77 +1,1063 @@
-from pprint import pprint
+from collections import defaultdict, deque
+import functools
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from threading import Lock, RLock, Timer
 
-from ovos_PHAL_plugin_commonIOT.opm import find_iot_plugins
-from ovos_PHAL_plugin_commonIOT.opm.base import IOTAbstractDevice
+from ovos_utils.log import LOG
+from ovos_utils.messagebus import Message
+
+from ovos_PHAL_plugin_commonIOT.identity import DeviceIdentityGraph
+from ovos_PHAL_plugin_commonIOT.isolation import IsolatedScanner, can_isolate
+from ovos_PHAL_plugin_commonIOT.metrics import METRICS
+from ovos_PHAL_plugin_commonIOT.name_index import DeviceNameIndex
+from ovos_PHAL_plugin_commonIOT.opm import find_iot_plugin_entry_points
+from ovos_PHAL_plugin_commonIOT.opm.base import IOTAbstractDevice, IOTCapabilties
+from ovos_PHAL_plugin_commonIOT.opm.ratelimit import get_rate_limiter
+from ovos_PHAL_plugin_commonIOT.registry import DeviceRegistryStore, device_from_record
+from ovos_PHAL_plugin_commonIOT.replay import ReplayScanner
+from ovos_PHAL_plugin_commonIOT.scheduler import IOTScanScheduler
 
 
 class CommonIOTDeviceManager:
-    def __init__(self, bus):
+    def __init__(self, bus, config=None):
         """
             Args:
                 bus (MycroftBusClient): The Mycroft bus client
+                config (dict): The plugin configuration
         """
         self.scanners = {}
+        # plugin name -> load timings and status, see load_scanners
+        self.startup_report = {}
         self.devices = {}
-        self.mappings = {}
+        self.device_scanners = {}  # device_id -> plugin name
+        # secondary indexes, attribute value -> device ids
+        self._host_index = defaultdict(set)
+        self._name_index = defaultdict(set)
+        self._class_index = defaultdict(set)
+        self._type_index = defaultdict(set)
+        self._area_index = defaultdict(set)
+        self._capability_index = defaultdict(set)  # IOTCapabilties -> ids
+        self._index_keys = {}  # device_id -> [(index, key)] it is listed under
+        # fuzzy spoken name -> device ids, for the voice interface
+        self.name_resolver = DeviceNameIndex()
+        self.lock = RLock()
+        # registry version, bumped on every device added/lost
+        self.version = 0
+        self._changelog = deque(maxlen=1000)  # (version, device_id)
+        self._snapshot = []
+        self._snapshot_version = -1
+        self._snapshot_data = {}  # device_id -> serialized device
+        self._snapshot_ids = []  # sorted keys of _snapshot_data
+        self._snapshot_lock = Lock()  # one rebuild at a time
+        # devices added, lost or changed since the snapshot was built
+        self._snapshot_dirty = set()
+        # change stream, see subscribe_changes
+        self._delta_subscribers = {}  # subscriber -> callback
+        self._delta_dirty = set()
+        self._delta_sent = {}  # device_id -> last published serialization
+        self._delta_timer = None
         self.bus = bus
+        self.config = config or {}
+        self.stopped = False  # set by shutdown, timers are not re-armed
+        # device_ids reported for the same physical device, eg. a TV seen
+        # by a LAN, an UPnP and a vendor plugin
+        self.identity = DeviceIdentityGraph(
+            self.config.get("identity_signals", ("host", "mac", "serial")))
+        # a single event loop drives every scanner
+        self.scheduler = IOTScanScheduler(
+            max_workers=self.config.get("max_scan_workers", 4))
+        # warm start, devices known on shutdown are restored as provisional
+        # until their scanner confirms them or they expire
+        self.registry = None
+        if self.config.get("persist_devices", True):
+            self.registry = DeviceRegistryStore(self.config.get("registry_path"),
+                                                self.config.get("registry_save_delay", 5))
+        self._save_timer = None
+        if self.registry is not None and self.config.get("registry_save_interval", 3600):
+            self._schedule_periodic_save()
+        self._provisional = {}  # plugin name -> [IOTAbstractDevice]
+        self._load_timers = {}  # plugin name -> scanner_load_timeout Timer
+        # optional periodic metrics summary on the bus
+        self.metrics = METRICS
+        self.metrics.enabled = self.config.get("metrics", True)
+        # per host limit for commands sent to devices, see opm.ratelimit
+        self.rate_limiter = get_rate_limiter()
+        self.rate_limiter.configure(self.config.get("rate_limits", {}))
+        self._metrics_timer = None
+        if self.config.get("metrics_summary_interval"):
+            self._schedule_metrics_summary()
+        # group and scene commands fan out over this pool
+        self.group_executor = ThreadPoolExecutor(
+            max_workers=self.config.get("max_group_workers", 8),
+            thread_name_prefix="iot-group")
 
         # BUS API
-        # self.bus.on("ovos.iot.get.devices", self.handle_get_devices)
-        # self.bus.on("ovos.iot.get.device", self.handle_get_device)
+        self.bus.on("ovos.iot.scan", self.handle_scan_request)
+        self.bus.on("ovos.iot.get.startup_report", self.handle_get_startup_report)
+        self.bus.on("ovos.iot.get.metrics", self.handle_get_metrics)
+        self.bus.on("ovos.iot.get.devices", self.handle_get_devices)
+        self.bus.on("ovos.iot.get.device", self.handle_get_device)
+        self.bus.on("ovos.iot.find.device", self.handle_find_device)
+        self.bus.on("ovos.iot.export.devices", self.handle_export_devices)
+        self.bus.on("ovos.iot.devices.subscribe", self.handle_subscribe_changes)
+        self.bus.on("ovos.iot.devices.unsubscribe", self.handle_unsubscribe_changes)
 
         # generic device actions
-        # self.bus.on("ovos.iot.device.turn_on", self.handle_turn_on)
-        # self.bus.on("ovos.iot.device.turn_off", self.handle_turn_off)
-        # self.bus.on("ovos.iot.device.sleep", self.handle_sleep)
-        # self.bus.on("ovos.iot.device.wakeup", self.handle_wakeup)
-        # self.bus.on("ovos.iot.device.reboot", self.handle_reboot)
-        # self.bus.on("ovos.iot.device.get.power.state", self.handle_get_power_state)
+        self.bus.on("ovos.iot.device.turn_on", self.handle_turn_on)
+        self.bus.on("ovos.iot.device.turn_off", self.handle_turn_off)
+        self.bus.on("ovos.iot.device.sleep", self.handle_sleep)
+        self.bus.on("ovos.iot.device.wakeup", self.handle_wakeup)
+        self.bus.on("ovos.iot.device.reboot", self.handle_reboot)
+        self.bus.on("ovos.iot.device.get.power.state", self.handle_get_power_state)
+        self.bus.on("ovos.iot.device.refresh", self.handle_refresh_state)
 
         # iot media player actions
-        # self.bus.on("ovos.iot.device.get.volume", self.handle_get_volume)
-        # self.bus.on("ovos.iot.device.set.volume", self.handle_set_volume)
-        # self.bus.on("ovos.iot.device.volume.up",  self.handle_volume_up)
-        # self.bus.on("ovos.iot.device.volume.down", self.handle_volume_down)
-        # self.bus.on("ovos.iot.device.mute", self.handle_mute)
-        # self.bus.on("ovos.iot.device.unmute", self.handle_unmute)
-
-    def disambiguate_new_device(self, device: IOTAbstractDevice):
-        # check if device with same ip exists
-        for dev_id, device2 in self.devices.items():
-            if device.host == device2.host:
-                print("duplicate device found, same host", device, device2)
-                if device.device_id not in self.mappings:
-                    self.mappings[device.device_id] = []
-                if device2.device_id not in self.mappings[device.device_id]:
-                    self.mappings[device.device_id].append(device2.device_id)
-
-                if device2.device_id not in self.mappings:
-                    self.mappings[device2.device_id] = []
-                if device.device_id not in self.mappings[device2.device_id]:
-                    self.mappings[device2.device_id].append(device.device_id)
-
-    def on_new_device(self, device: IOTAbstractDevice):
-        self.disambiguate_new_device(device)
-        pprint(device.as_dict)
-        self.devices[device.device_id] = device
+        self.bus.on("ovos.iot.device.get.volume", self.handle_get_volume)
+        self.bus.on("ovos.iot.device.set.volume", self.handle_set_volume)
+        self.bus.on("ovos.iot.device.volume.up", self.handle_volume_up)
+        self.bus.on("ovos.iot.device.volume.down", self.handle_volume_down)
+        self.bus.on("ovos.iot.device.mute", self.handle_mute)
+        self.bus.on("ovos.iot.device.unmute", self.handle_unmute)
+
+        # coalesced commands, for bursts such as GUI sliders
+        self.bus.on("ovos.iot.device.command", self.handle_device_command)
+
+        # group actions
+        self.bus.on("ovos.iot.group.call", self.handle_group_call)
+        self.bus.on("ovos.iot.scene.run", self.handle_run_scene)
+
+    @property
+    def mappings(self):
+        """ device_id -> list of other device_ids reported for the same
+        physical device"""
+        mappings = {}
+        for ids in self.identity.groups().values():
+            for dev_id in ids:
+                mappings[dev_id] = [d for d in ids if d != dev_id]
+        return mappings
+
+    def backing_device(self, device_id, action=None):
+        """ device that should receive commands for device_id, the best
+        report of the same physical device that supports action
+
+        config["scanner_priority"] lists preferred plugins first, then
+        confirmed devices with more capabilities win, then the canonical id
+        of the group, so every id of a physical device picks the same report
+        """
+        with self.lock:
+            candidates = [self.devices[d] for d in self.identity.group(device_id)
+                          if d in self.devices]
+            if not candidates:
+                return self.devices.get(device_id)
+            if action:
+                candidates = [d for d in candidates
+                              if callable(getattr(d, action, None))] or candidates
+            priority = self.config.get("scanner_priority", [])
+            canonical = self.identity.canonical_id(device_id)
+
+            def score(device):
+                plugin = self.device_scanners.get(device.device_id)
+                rank = priority.index(plugin) if plugin in priority else len(priority)
+                return (-rank, not device.is_provisional,
+                        len(device.capabilities), device.device_id == canonical,
+                        device.device_id)
+
+            return max(candidates, key=score)
+
+    def get_devices_by_host(self, host):
+        with self.lock:
+            return [self.devices[d] for d in self._host_index.get(host, ())]
+
+    def get_devices_by_name(self, name):
+        with self.lock:
+            return [self.devices[d] for d in self._name_index.get(name, ())]
+
+    def get_devices_by_class(self, device_class):
+        with self.lock:
+            return [self.devices[d] for d in self._class_index.get(device_class, ())]
+
+    def find_devices(self, phrase, k=5, min_score=None):
+        """ devices whose name, area + name or alias best match a spoken phrase
+
+        Returns:
+            list: up to k (IOTAbstractDevice, score) tuples, best first
+        """
+        if min_score is None:
+            min_score = self.config.get("name_min_score", 0.3)
+        with self.lock:
+            return [(self.devices[d], score) for d, score in
+                    self.name_resolver.lookup(phrase, k, min_score)
+                    if d in self.devices]
+
+    @staticmethod
+    def _area_key(device: IOTAbstractDevice):
+        # plugins may report structured areas, eg. the LAN plugin reports
+        # a dict of addresses, only plain area names are indexed
+        area = device.device_area
+        return area if isinstance(area, str) else None
+
+    def _spoken_names(self, device: IOTAbstractDevice, scanner=None):
+        names = [device.name]
+        area = self._area_key(device)
+        if area:
+            names.append(f"{area} {device.name}")
+        plugin = self.scanners.get(scanner)
+        if plugin is not None:
+            # scanner aliases are keyed by device_id or device name
+            aliases = plugin.aliases.get(device.device_id) or \
+                plugin.aliases.get(device.name) or []
+            if isinstance(aliases, str):
+                aliases = [aliases]
+            names += aliases
+        return names
+
+    def _index_device(self, device: IOTAbstractDevice, scanner=None):
+        keys = [(self._host_index, device.host),
+                (self._name_index, device.name),
+                (self._class_index, device.__class__.__name__),
+                (self._type_index, device.device_type)]
+        area = self._area_key(device)
+        if area is not None:
+            keys.append((self._area_index, area))
+        keys += [(self._capability_index, c) for c in device.capabilities]
+        for index, key in keys:
+            index[key].add(device.device_id)
+        # keys are kept, plugins may update name/host/area in place
+        self._index_keys[device.device_id] = keys
+        self.name_resolver.add(device.device_id,
+                               self._spoken_names(device, scanner))
+
+    def _unindex_device(self, device: IOTAbstractDevice):
+        for index, key in self._index_keys.pop(device.device_id, ()):
+            ids = index.get(key)
+            if ids is None:
+                continue
+            ids.discard(device.device_id)
+            if not ids:
+                index.pop(key)
+        self.name_resolver.remove(device.device_id)
+
+    def disambiguate_new_device(self, device: IOTAbstractDevice, scanner=None):
+        """ link device to other reports of the same physical device"""
+        group = set(self.identity.group(device.device_id))
+        merged = self.identity.add(device.device_id, device.identity_signals(),
+                                   scanner)
+        if merged:
+            self.metrics.incr("manager.identity_merges", merged)
+        # physical_id of devices joining or leaving the group may change
+        group.update(self.identity.group(device.device_id))
+        self._snapshot_dirty.update(group)
+
+    def _configure_device(self, device: IOTAbstractDevice):
+        # state cache ttl, a number or a device class name -> ttl mapping
+        ttl = self.config.get("state_ttl")
+        if isinstance(ttl, dict):
+            ttl = ttl.get(device.__class__.__name__)
+        if ttl is not None:
+            device.state_ttl = ttl
+        device.state_listener = self.on_state_changed
+
+    def on_new_device(self, device: IOTAbstractDevice, scanner=None):
+        self._configure_device(device)
+        with self.lock:
+            old_device = self.devices.get(device.device_id)
+            if old_device is not None:
+                self._unindex_device(old_device)
+            self.disambiguate_new_device(device, scanner)
+            self.devices[device.device_id] = device
+            if scanner:
+                self.device_scanners[device.device_id] = scanner
+            self._index_device(device, scanner)
+            self._bump_version(device.device_id)
+        self._schedule_save()
+
+    def on_device_updated(self, device: IOTAbstractDevice, scanner=None):
+        """ a known device was reported with new attributes, eg. a new name
+        or host, device may be a new object or the tracked one updated in place"""
+        device.invalidate_cache()
+        self.on_new_device(device, scanner)
+
+    def on_state_changed(self, device: IOTAbstractDevice):
+        """ device state changed by a command or noticed on read, one
+        version bump per device until the snapshot is rebuilt"""
+        with self.lock:
+            if self.devices.get(device.device_id) is not device:
+                return
+            if device.device_id in self._snapshot_dirty:
+                self._mark_changed(device.device_id)
+                return
+            self._bump_version(device.device_id)
 
     def on_device_lost(self, device: IOTAbstractDevice):
-        pprint(device.as_dict)
-        if device.device_id in self.devices:
-            self.devices.pop(device.device_id)
+        with self.lock:
+            if device.device_id in self.devices:
+                self.identity.remove(device.device_id)
+                self._unindex_device(self.devices.pop(device.device_id))
+                self.device_scanners.pop(device.device_id, None)
+                self._bump_version(device.device_id)
+        self._schedule_save()
+
+    # persistence
+    def get_records(self):
+        """ IOTAbstractDevice.as_record of every device, tagged with the
+        plugin that reported it, devices confirmed by their scanner are
+        stamped as "saved" now, they are still present as far as we know"""
+        now = time.time()
+        with self.lock:
+            records = []
+            for dev_id, device in self.devices.items():
+                record = device.as_record()
+                record["scanner"] = self.device_scanners.get(dev_id)
+                if not device.is_provisional:
+                    record["saved"] = now
+                records.append(record)
+            return records
+
+    def _schedule_save(self):
+        if self.registry is not None:
+            self.registry.schedule_save(self.get_records)
+
+    def _schedule_periodic_save(self):
+        # devices that are never added or lost would otherwise keep the
+        # timestamp of the last add/lost save and age out of the registry
+        self._save_timer = Timer(self.config.get("registry_save_interval", 3600),
+                                 self._periodic_save)
+        self._save_timer.daemon = True
+        self._save_timer.start()
+
+    def _periodic_save(self):
+        self.registry.flush(self.get_records)
+        if not self.stopped:
+            self._schedule_periodic_save()
+
+    def _saved_records(self, plugins):
+        """ device records saved by a previous run, per plugin"""
+        saved = {}
+        if self.registry is None:
+            return saved
+        for record in self.registry.load(self.config.get("registry_max_age", 86400)):
+            plugin = record.get("scanner")
+            if plugin in plugins:
+                saved.setdefault(plugin, []).append(record)
+        return saved
 
-    def load_scanners(self):
-        for plugin, scanner_clazz in find_iot_plugins().items():
+    def _restore_devices(self, plugin, records):
+        """ register devices saved by a previous run as provisional, called
+        once the plugin module is imported so its device classes are used,
+        they are handed to the scanner once it is constructed"""
+        for record in records:
+            if record["device_id"] in self.devices:
+                continue
             try:
-                scanner = scanner_clazz(self.bus,
-                                        new_device_callback=self.on_new_device,
-                                        lost_device_callback=self.on_device_lost)
-                print(f"loaded {plugin}")
-            except:
-                print(f"{plugin} failed to load")
+                device = device_from_record(record)
+            except Exception as e:
+                LOG.error(f"failed to restore device {record['device_id']}: {e}")
                 continue
+            self._provisional.setdefault(plugin, []).append(device)
+            self.on_new_device(device, scanner=plugin)
+
+    def _drop_provisional(self, plugin):
+        for device in self._provisional.pop(plugin, []):
+            if self.devices.get(device.device_id) is device:
+                self.on_device_lost(device)
+
+    def _bump_version(self, device_id):
+        self.version += 1
+        self._changelog.append((self.version, device_id))
+        self._snapshot_dirty.add(device_id)
+        self._mark_changed(device_id)
+
+    # snapshots
+    @staticmethod
+    def serialize_device(device: IOTAbstractDevice):
+        data = dict(device.as_dict)
+        # not every device class reports the full set of keys
+        data.setdefault("device_id", device.device_id)
+        data.setdefault("area", device.device_area)
+        data.setdefault("device_class", device.__class__.__name__)
+        data["capabilities"] = [c.name for c in device.capabilities]
+        return data
+
+    def _serialize(self, device: IOTAbstractDevice):
+        data = self.serialize_device(device)
+        data["physical_id"] = self.identity.canonical_id(device.device_id)
+        return data
+
+    def get_snapshot(self):
+        """ serialized devices sorted by device_id, the snapshot is cached
+        and only devices added, lost or changed since it was built are
+        serialized again
+
+        Returns:
+            (int, list): registry version and serialized devices
+        """
+        with self._snapshot_lock:
+            with self.lock:
+                if self._snapshot_version == self.version:
+                    return self._snapshot_version, self._snapshot
+                version = self.version
+                dirty, self._snapshot_dirty = self._snapshot_dirty, set()
+                devices = {d: self.devices.get(d) for d in dirty}
+            # reading device state may query the device, this must not
+            # block the scanner callbacks waiting for self.lock
+            data = self._snapshot_data
+            resort = False
+            for dev_id, device in devices.items():
+                if device is None:
+                    resort |= data.pop(dev_id, None) is not None
+                else:
+                    resort |= dev_id not in data
+                    data[dev_id] = self._serialize(device)
+            if resort:
+                self._snapshot_ids = sorted(data)
+            # a new list, readers may still hold the previous snapshot
+            self._snapshot = [data[d] for d in self._snapshot_ids]
+            # state changes while serializing bump the version again,
+            # the next request then serializes those devices
+            self._snapshot_version = version
+            return version, self._snapshot
+
+    def changed_since(self, version):
+        """ device_ids added or lost after version,
+        None if the changelog no longer covers that version"""
+        with self.lock:
+            if self._changelog and self._changelog[0][0] > version + 1:
+                return None
+            return {dev_id for v, dev_id in self._changelog if v > version}
+
+    # streaming export
+    def iter_devices(self, chunk_size=100, device_type=None, area=None,
+                     capability=None):
+        """ serialized devices in chunks of up to chunk_size, all chunks
+        come from the same registry version
+
+        Yields:
+            (int, list): registry version and a chunk of serialized devices
+        """
+        version, devices = self.get_snapshot()
+        selected = self._select_ids(device_type=device_type, area=area,
+                                    capability=capability)
+        if selected is not None:
+            devices = [d for d in devices if d["device_id"] in selected]
+        for start in range(0, len(devices), chunk_size):
+            yield version, devices[start:start + chunk_size]
+
+    def export_ndjson(self, path, **filters):
+        """ write serialized devices to path, one json object per line,
+        the file is replaced atomically
+
+        Returns:
+            (int, int): registry version and number of devices written
+        """
+        version, total = self.version, 0
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            for version, chunk in self.iter_devices(**filters):
+                f.writelines(json.dumps(d, separators=(",", ":"), default=str) + "\n"
+                             for d in chunk)
+                total += len(chunk)
+        os.replace(tmp, path)
+        return version, total
+
+    # change stream
+    def subscribe_changes(self, subscriber, callback):
+        """ call callback({"version", "changed", "removed"}) with the devices
+        added, updated or lost, changes are batched every
+        config["delta_interval"] seconds and unchanged devices are skipped"""
+        with self.lock:
+            self._delta_subscribers[subscriber] = callback
+
+    def unsubscribe_changes(self, subscriber):
+        with self.lock:
+            self._delta_subscribers.pop(subscriber, None)
+            if not self._delta_subscribers:
+                self._delta_dirty.clear()
+                self._delta_sent.clear()
+
+    def _mark_changed(self, device_id):
+        if not self._delta_subscribers:
+            return
+        with self.lock:
+            self._delta_dirty.add(device_id)
+            if self._delta_timer is None:
+                self._delta_timer = Timer(self.config.get("delta_interval", 0.5),
+                                          self._flush_changes)
+                self._delta_timer.daemon = True
+                self._delta_timer.start()
+
+    def _flush_changes(self):
+        changed, removed = [], []
+        with self.lock:
+            self._delta_timer = None
+            dirty, self._delta_dirty = self._delta_dirty, set()
+            for dev_id in sorted(dirty):
+                device = self.devices.get(dev_id)
+                if device is None:
+                    self._delta_sent.pop(dev_id, None)
+                    removed.append(dev_id)
+                    continue
+                data = self._serialize(device)
+                if data != self._delta_sent.get(dev_id):
+                    self._delta_sent[dev_id] = data
+                    changed.append(data)
+            callbacks = set(self._delta_subscribers.values())
+            version = self.version
+        if not changed and not removed:
+            return
+        delta = {"version": version, "changed": changed, "removed": removed}
+        for callback in callbacks:
+            try:
+                callback(delta)
+            except Exception:
+                LOG.exception("device change subscriber failed")
+
+    def _emit_changes(self, delta):
+        self.bus.emit(Message("ovos.iot.devices.changed", delta))
+
+    @staticmethod
+    def _as_capability(capability):
+        # bus messages refer to capabilities by name
+        if isinstance(capability, IOTCapabilties):
+            return capability
+        return IOTCapabilties.__members__.get(str(capability).upper())
+
+    def _select_ids(self, device_type=None, area=None, capability=None):
+        """ device_ids matching all the given filters, as an intersection
+        of the secondary indexes, None if no filter was given"""
+        with self.lock:
+            matches = []
+            if device_type:
+                matches.append(self._type_index.get(device_type, set()))
+            if area:
+                matches.append(self._area_index.get(area, set()))
+            if capability:
+                matches.append(self._capability_index.get(
+                    self._as_capability(capability), set()))
+            if not matches:
+                return None
+            matches.sort(key=len)
+            return matches[0].intersection(*matches[1:])
+
+    def select_devices(self, device_type=None, area=None, capability=None):
+        """ device_ids matching all the given filters"""
+        ids = self._select_ids(device_type=device_type, area=area,
+                               capability=capability)
+        if ids is None:
+            with self.lock:
+                ids = list(self.devices)
+        return sorted(ids)
+
+    def get_capabilities(self, area=None):
+        """ capabilities of at least one known device, optionally only
+        devices in area, eg. to decide which voice intents apply"""
+        with self.lock:
+            if area is None:
+                return set(self._capability_index)
+            in_area = self._area_index.get(area, set())
+            return {c for c, ids in self._capability_index.items()
+                    if not in_area.isdisjoint(ids)}
+
+    # group commands
+    def group_call(self, device_ids, action, *args, timeout=10, **kwargs):
+        """ call action on every device in parallel,
+        total latency is bound by the slowest device or by timeout
+
+        Returns:
+            dict: device_id -> call_device result
+        """
+        return self.run_scene([{"device_ids": device_ids, "action": action,
+                                "args": args, "kwargs": kwargs}],
+                              timeout=timeout)
+
+    def run_scene(self, steps, timeout=10):
+        """ run a list of actions in parallel, each step is a dict with
+        "action", optional "args"/"kwargs", and either "device_ids" or
+        "device_type"/"area"/"capability" filters
+
+        every physical device is called once per step, ids reported for
+        the same physical device share the result of that call
+
+        Returns:
+            dict: device_id -> call_device result, a device targeted by
+                  several steps reports the result of the last one
+        """
+        futures = {}
+        for step in steps:
+            device_ids = step.get("device_ids")
+            if device_ids is None:
+                device_ids = self.select_devices(device_type=step.get("device_type"),
+                                                 area=step.get("area"),
+                                                 capability=step.get("capability"))
+            targets = {}  # canonical id -> requested ids
+            for dev_id in device_ids:
+                targets.setdefault(self.identity.canonical_id(dev_id), []).append(dev_id)
+            for ids in targets.values():
+                fut = self.group_executor.submit(self.call_device, ids[0],
+                                                 step["action"],
+                                                 *step.get("args", ()),
+                                                 **step.get("kwargs", {}))
+                futures[fut] = ids
+        done, not_done = wait(futures, timeout=timeout)
+        results = {}
+        for fut in not_done:
+            fut.cancel()
+            for dev_id in futures[fut]:
+                results[dev_id] = {"device_id": dev_id, "error": "timeout"}
+        for fut in done:
+            result = fut.result()
+            for dev_id in futures[fut]:
+                results[dev_id] = dict(result, device_id=dev_id)
+        return results
+
+    # bus api
+    def handle_group_call(self, message):
+        """ message.data: "action", optional "args", "timeout" and either
+        "device_ids" or "device_type"/"area"/"capability" filters"""
+        results = self.run_scene([message.data],
+                                 timeout=message.data.get("timeout", 10))
+        self.bus.emit(message.response({"results": results}))
+
+    def handle_run_scene(self, message):
+        """ message.data: "steps" (see run_scene) and optional "timeout" """
+        results = self.run_scene(message.data.get("steps", []),
+                                 timeout=message.data.get("timeout", 10))
+        self.bus.emit(message.response({"results": results}))
+
+    def handle_get_devices(self, message):
+        """ paginated device listing
+
+        message.data may contain "page", "page_size", "device_type",
+        "area", "capability" and "since_version", when since_version is
+        given only devices changed since then are returned and lost
+        device_ids are listed under "removed"
+
+        "full" is True when every device is listed, eg. because
+        since_version is older than the changelog, clients mirroring the
+        registry must then drop devices missing from the listing
+        """
+        version, devices = self.get_snapshot()
+        since = message.data.get("since_version")
+        removed = []
+        full = True
+        if since is not None:
+            changed = self.changed_since(since)
+            if changed is not None:
+                full = False
+                removed = sorted(changed.difference(d["device_id"] for d in devices))
+                devices = [d for d in devices if d["device_id"] in changed]
+
+        selected = self._select_ids(device_type=message.data.get("device_type"),
+                                    area=message.data.get("area"),
+                                    capability=message.data.get("capability"))
+        if selected is not None:
+            devices = [d for d in devices if d["device_id"] in selected]
+        page = message.data.get("page", 0)
+        page_size = message.data.get("page_size", 50)
+        start = page * page_size
+        self.bus.emit(message.response({
+            "version": version,
+            "total": len(devices),
+            "page": page,
+            "page_size": page_size,
+            "devices": devices[start:start + page_size],
+            "removed": removed,
+            "full": full
+        }))
+
+    def handle_get_device(self, message):
+        device = self.devices.get(message.data.get("device_id"))
+        if device is None:
+            self.bus.emit(message.response({"error": "device not found"}))
+            return
+        self.bus.emit(message.response({"device": self._serialize(device),
+                                        "version": self.version}))
+
+    def _export_path(self, path):
+        # the bus is not trusted with arbitrary file paths
+        export_dir = self.config.get("export_dir")
+        if not export_dir:
+            raise PermissionError("exporting to a file requires config[\"export_dir\"]")
+        export_dir = os.path.realpath(export_dir)
+        path = os.path.realpath(os.path.join(export_dir, path))
+        if os.path.commonpath([export_dir, path]) != export_dir or path == export_dir:
+            raise PermissionError(f"{path} is not a file inside {export_dir}")
+        return path
+
+    def handle_export_devices(self, message):
+        """ stream every device, message.data may contain "chunk_size" and
+        "device_type"/"area"/"capability" filters
+
+        devices are sent as "ovos.iot.export.devices.chunk" replies, the
+        final response reports the number of chunks, with "path" in
+        message.data the devices are written there as NDJSON instead,
+        path must be inside config["export_dir"], relative paths are
+        relative to it
+        """
+        filters = {k: message.data.get(k)
+                   for k in ("device_type", "area", "capability")}
+        path = message.data.get("path")
+        if path:
+            try:
+                path = self._export_path(path)
+                version, total = self.export_ndjson(path, **filters)
+            except Exception as e:
+                self.bus.emit(message.response({"error": str(e)}))
+                return
+            self.bus.emit(message.response({"version": version, "total": total,
+                                            "path": path}))
+            return
+        version, total, chunks = self.version, 0, 0
+        for version, chunk in self.iter_devices(message.data.get("chunk_size", 100),
+                                                **filters):
+            self.bus.emit(message.reply("ovos.iot.export.devices.chunk",
+                                        {"version": version, "chunk": chunks,
+                                         "devices": chunk}))
+            chunks += 1
+            total += len(chunk)
+        self.bus.emit(message.response({"version": version, "total": total,
+                                        "chunks": chunks}))
+
+    def handle_subscribe_changes(self, message):
+        """ broadcast device changes as "ovos.iot.devices.changed" messages
+        until every subscriber unsubscribes, message.data: "subscriber" """
+        subscriber = message.data.get("subscriber", "bus")
+        self.subscribe_changes(f"bus:{subscriber}", self._emit_changes)
+        self.bus.emit(message.response({"subscriber": subscriber,
+                                        "version": self.version}))
+
+    def handle_unsubscribe_changes(self, message):
+        self.unsubscribe_changes(f"bus:{message.data.get('subscriber', 'bus')}")
+
+    def handle_find_device(self, message):
+        """ message.data: "phrase" and optional "k", eg. "kitchen lamp" """
+        matches = self.find_devices(message.data["phrase"],
+                                    k=message.data.get("k", 5))
+        self.bus.emit(message.response({
+            "matches": [{"device_id": device.device_id, "score": score}
+                        for device, score in matches]
+        }))
+
+    def call_device(self, device_id, action, *args, **kwargs):
+        """ call a device method by name, only IOTAbstractDevice.bus_actions
+        of the device may be called, devices restored from the registry
+        refuse commands until their scanner confirms them
+
+        Returns:
+            dict: {"device_id", "result"} or {"device_id", "error"}
+        """
+        device = self.backing_device(device_id, action)
+        if device is None:
+            return {"device_id": device_id, "error": "device not found"}
+        if action not in device.bus_actions:
+            return {"device_id": device_id, "error": f"{action} not allowed"}
+        if device.is_provisional:
+            # restored from the registry, possibly as a generic placeholder
+            return {"device_id": device_id, "error": "device not confirmed yet"}
+        method = getattr(device, action, None)
+        if not callable(method):
+            return {"device_id": device_id, "error": f"{action} not supported"}
+        start = time.monotonic()
+        try:
+            return {"device_id": device_id, "result": method(*args, **kwargs)}
+        except Exception as e:
+            METRICS.incr(f"command.{device.__class__.__name__}.errors")
+            return {"device_id": device_id, "error": str(e)}
+        finally:
+            METRICS.observe(f"command.{device.__class__.__name__}.rtt",
+                            time.monotonic() - start)
+            self._mark_changed(device.device_id)
+
+    def queue_command(self, device_id, action, *args, **kwargs):
+        """ queue a command in the device command queue, returns immediately,
+        superseded commands of the same kind are merged before sending
+
+        Returns:
+            dict: {"device_id", "queued"} or {"device_id", "error"}
+        """
+        device = self.backing_device(device_id, action)
+        if device is None:
+            return {"device_id": device_id, "error": "device not found"}
+        if action not in device.bus_actions:
+            return {"device_id": device_id, "error": f"{action} not allowed"}
+        if device.is_provisional:
+            # restored from the registry, possibly as a generic placeholder
+            return {"device_id": device_id, "error": "device not confirmed yet"}
+        if not callable(getattr(device, action, None)):
+            return {"device_id": device_id, "error": f"{action} not supported"}
+        device.submit(action, *args, **kwargs)
+        self._mark_changed(device.device_id)
+        return {"device_id": device_id, "queued": True}
+
+    def _handle_device_action(self, message, action, *args):
+        self.bus.emit(message.response(
+            self.call_device(message.data.get("device_id"), action, *args)))
+
+    def handle_device_command(self, message):
+        """ message.data: "device_id", "action" and optional "args" """
+        self.bus.emit(message.response(
+            self.queue_command(message.data.get("device_id"),
+                               message.data["action"],
+                               *message.data.get("args", []))))
+
+    def handle_turn_on(self, message):
+        self._handle_device_action(message, "turn_on")
+
+    def handle_turn_off(self, message):
+        self._handle_device_action(message, "turn_off")
+
+    def handle_sleep(self, message):
+        self._handle_device_action(message, "sleep")
+
+    def handle_wakeup(self, message):
+        self._handle_device_action(message, "wakeup")
+
+    def handle_reboot(self, message):
+        self._handle_device_action(message, "reboot")
+
+    def handle_get_power_state(self, message):
+        device_id = message.data.get("device_id")
+        device = self.backing_device(device_id)
+        if device is None:
+            self.bus.emit(message.response({"device_id": device_id,
+                                            "error": "device not found"}))
+            return
+        self.bus.emit(message.response({"device_id": device_id,
+                                        "result": device.is_on}))
+
+    def handle_refresh_state(self, message):
+        """ re-read the device state, bypassing the state cache"""
+        device_id = message.data.get("device_id")
+        device = self.devices.get(device_id)
+        if device is None:
+            self.bus.emit(message.response({"device_id": device_id,
+                                            "error": "device not found"}))
+            return
+        try:
+            device.refresh_state()
+        except Exception as e:
+            self.bus.emit(message.response({"device_id": device_id,
+                                            "error": str(e)}))
+            return
+        self.bus.emit(message.response({"device": self._serialize(device)}))
+
+    def handle_get_volume(self, message):
+        self._handle_device_action(message, "get_volume")
+
+    def handle_set_volume(self, message):
+        self._handle_device_action(message, "set_volume",
+                                   message.data["volume"])
+
+    def handle_volume_up(self, message):
+        self._handle_device_action(message, "volume_up")
+
+    def handle_volume_down(self, message):
+        self._handle_device_action(message, "volume_down")
+
+    def handle_mute(self, message):
+        self._handle_device_action(message, "mute")
+
+    def handle_unmute(self, message):
+        self._handle_device_action(message, "unmute")
+
+    def handle_scan_request(self, message):
+        """ scan at the burst interval for a while,
+        optionally only for the scanner named in message.data["scanner"]"""
+        name = message.data.get("scanner")
+        for plugin, scanner in self.scanners.items():
+            if name in (None, plugin, scanner.name):
+                scanner.request_burst()
+
+    def load_scanners(self, wait_for_load=False):
+        """ import and construct every scanner plugin concurrently
+
+        each plugin is registered as soon as it is ready, a plugin that
+        takes longer than config["scanner_load_timeout"] is marked as
+        timed out and discarded if it ever finishes loading
+
+        Args:
+            wait_for_load (bool): block until every plugin loaded or timed out
+        """
+        if not self.scheduler.is_alive():
+            self.scheduler.start()
+        timeout = self.config.get("scanner_load_timeout", 30)
+        loader = ThreadPoolExecutor(
+            max_workers=self.config.get("max_loader_workers", 4),
+            thread_name_prefix="iot-loader")
+        futures = []
+        entry_points = find_iot_plugin_entry_points()
+        saved = self._saved_records(entry_points)
+        for plugin, entry_point in entry_points.items():
+            with self.lock:
+                self.startup_report[plugin] = {"status": "loading",
+                                               "started": time.time()}
+            futures.append(loader.submit(self._load_scanner, plugin, entry_point,
+                                         saved.get(plugin, [])))
+            timer = self._load_timers[plugin] = Timer(timeout, self._on_load_timeout,
+                                                      (plugin,))
+            timer.daemon = True
+            timer.start()
+        loader.shutdown(wait=False)
+        self.load_replay()
+        if wait_for_load:
+            wait(futures, timeout=timeout)
+
+    def _on_load_timeout(self, plugin):
+        with self.lock:
+            if self.startup_report[plugin]["status"] != "loading":
+                return
+            LOG.error(f"{plugin} timed out while loading")
+            self.startup_report[plugin]["status"] = "timeout"
+        self._drop_provisional(plugin)
+
+    def _load_scanner(self, plugin, entry_point, saved=()):
+        report = self.startup_report[plugin]
+        kwargs = {}
+        # per plugin overrides, eg. scan intervals and ttl
+        if plugin in self.config.get("scanners", {}):
+            kwargs["config"] = self.config["scanners"][plugin]
+            if "aliases" in kwargs["config"]:
+                kwargs["aliases"] = kwargs["config"]["aliases"]
+        try:
+            start = time.monotonic()
+            scanner_clazz = entry_point.load()
+            report["import_time"] = time.monotonic() - start
+            # saved devices of this plugin, now with its own device classes
+            self._restore_devices(plugin, saved)
+            if plugin in self.config.get("isolated_scanners", []):
+                if can_isolate(scanner_clazz):
+                    # the plugin itself is constructed in the worker process
+                    kwargs["name"] = plugin
+                    scanner_clazz = functools.partial(IsolatedScanner, scanner_clazz)
+                    report["isolated"] = True
+                else:
+                    LOG.warning(f"{plugin} can not run in a worker process, "
+                                f"loading it in process")
+            start = time.monotonic()
+            scanner = scanner_clazz(
+                self.bus,
+                new_device_callback=lambda d: self.on_new_device(d, scanner=plugin),
+                lost_device_callback=self.on_device_lost,
+                **kwargs)
+            scanner.updated_device_callback = \
+                lambda d: self.on_device_updated(d, scanner=plugin)
+            report["init_time"] = time.monotonic() - start
+        except Exception as e:
+            LOG.exception(f"{plugin} failed to load")
+            with self.lock:
+                report["status"] = "failed"
+                report["error"] = str(e)
+            self._drop_provisional(plugin)
+            return
+
+        with self.lock:
+            timed_out = report["status"] == "timeout"
+            if not timed_out:
+                report["status"] = "loaded"
+                report["loaded"] = time.time()
+                self.scanners[plugin] = scanner
+        if timed_out:
+            LOG.warning(f"{plugin} finished loading after timeout, discarded")
+            self._drop_provisional(plugin)
+            return
+        timer = self._load_timers.pop(plugin, None)
+        if timer is not None:
+            timer.cancel()
+        LOG.info(f"loaded {plugin}")
+        # confirmed by the next scans or expired by the usual ttl logic
+        scanner.adopt_devices(self._provisional.pop(plugin, []))
+        if scanner.overrides_run:
+            # plugin implements its own scan loop
             scanner.start()
+        else:
+            self.scheduler.add_scanner(plugin, scanner)
+
+    def load_replay(self, config=None):
+        """ feed a recording made with config["record_path"] back through
+        this manager, eg. to reproduce a bug report or for load tests
+
+        config defaults to config["replay"], a ReplayScanner config with
+        "replay_path" and optionally "name" (default "replay"), the
+        replay runs in its own thread and is listed as a scanner
+
+        Returns:
+            ReplayScanner: the started replay, None if nothing to replay
+        """
+        if config is None:
+            config = self.config.get("replay")
+        if not config or not config.get("replay_path"):
+            return None
+        plugin = config.get("name", "replay")
+        scanner = ReplayScanner(
+            self.bus, name=plugin, config=config,
+            new_device_callback=lambda d: self.on_new_device(d, scanner=plugin),
+            lost_device_callback=self.on_device_lost)
+        scanner.updated_device_callback = \
+            lambda d: self.on_device_updated(d, scanner=plugin)
+        now = time.time()
+        with self.lock:
+            self.startup_report[plugin] = {"status": "loaded", "started": now,
+                                           "loaded": now, "replay": True}
             self.scanners[plugin] = scanner
+        LOG.info(f"replaying {config['replay_path']} as {plugin}")
+        scanner.start()
+        return scanner
+
+    def shutdown(self, timeout=5):
+        """ stop scanning and every background thread and timer of the
+        manager, pending registry changes are written to disk"""
+        self.stopped = True
+        for timer in [self._save_timer, self._metrics_timer, self._delta_timer,
+                      *self._load_timers.values()]:
+            if timer is not None:
+                timer.cancel()
+        self._load_timers.clear()
+        self.scheduler.shutdown(timeout)
+        self.group_executor.shutdown(wait=False)
+        with self.lock:
+            scanners = list(self.scanners.values())
+        for scanner in scanners:
+            if isinstance(scanner, IsolatedScanner):
+                scanner.stop_worker()
+            if scanner.recorder is not None:
+                scanner.recorder.close()
+        if self.registry is not None:
+            self.registry.flush(self.get_records)
+
+    def get_startup_report(self):
+        """ per plugin status, import_time, init_time and first_scan_time,
+        timings are in seconds, first_scan_time is measured from the moment
+        the plugin finished loading"""
+        with self.lock:
+            report = {}
+            for plugin, data in self.startup_report.items():
+                data = dict(data)
+                scanner = self.scanners.get(plugin)
+                if scanner is not None and scanner.first_scan is not None:
+                    data["first_scan_time"] = scanner.first_scan - data["loaded"]
+                report[plugin] = data
+            return report
+
+    def _schedule_metrics_summary(self):
+        self._metrics_timer = Timer(self.config["metrics_summary_interval"],
+                                    self._emit_metrics_summary)
+        self._metrics_timer.daemon = True
+        self._metrics_timer.start()
+
+    def _emit_metrics_summary(self):
+        summary = self.metrics.summary()
+        LOG.info(f"iot metrics: {summary['counters']}")
+        self.bus.emit(Message("ovos.iot.metrics", summary))
+        if not self.stopped:
+            self._schedule_metrics_summary()
+
+    def handle_get_metrics(self, message):
+        self.bus.emit(message.response(self.metrics.summary()))
+
+    def handle_get_startup_report(self, message):
+        self.bus.emit(message.response({"scanners": self.get_startup_report()}))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,206 @@
+import itertools
+from threading import RLock
+
+# unique per physical device, two reports sharing one are always merged
+STRONG_SIGNALS = ("mac", "serial")
+
+
+class DeviceIdentityGraph:
+    """ disjoint-set of device_ids reported for the same physical device
+
+    device_ids sharing a mac or serial are merged. Weak signals (host,
+    name) only merge reports from different scanners, and only while each
+    scanner reports a single device for that value, so devices behind a
+    hub or bridge sharing its ip are not merged with each other.
+
+    A group keeps its canonical id, the first device_id seen in it, for
+    as long as it exists, and is pruned once every member is lost.
+    When a device is reported with different signals (eg. a new dhcp
+    lease) its old signals are released and its group is rebuilt, so
+    devices it was only joined to through them are split off again"""
+
+    def __init__(self, signals=("host", "mac", "serial")):
+        self.signals = set(signals)
+        self._parent = {}  # device_id -> parent device_id
+        self._members = {}  # root -> device_ids, live and lost
+        self._live = {}  # root -> number of live members
+        self._canonical = {}  # root -> (seq, device_id) of the oldest member
+        self._first_seen = {}  # device_id -> (seq, device_id)
+        self._seq = itertools.count()
+        self._alive = set()
+        self._strong = {}  # (signal, value) -> device_id
+        self._weak = {}  # (signal, value) -> {scanner: device_ids}
+        self._keys = {}  # device_id -> [(signal, value, scanner)]
+        self.lock = RLock()
+
+    def __contains__(self, device_id):
+        return device_id in self._parent
+
+    def _find(self, device_id):
+        parent = self._parent
+        while parent[device_id] != device_id:
+            # path halving
+            parent[device_id] = parent[parent[device_id]]
+            device_id = parent[device_id]
+        return device_id
+
+    def _union(self, a, b):
+        ra, rb = self._find(a), self._find(b)
+        if ra == rb:
+            return False
+        # union by size
+        if len(self._members[ra]) < len(self._members[rb]):
+            ra, rb = rb, ra
+        self._parent[rb] = ra
+        self._members[ra] |= self._members.pop(rb)
+        self._live[ra] += self._live.pop(rb)
+        # the oldest canonical id wins, ids stay stable across merges
+        self._canonical[ra] = min(self._canonical[ra], self._canonical.pop(rb))
+        return True
+
+    def add(self, device_id, signals, scanner=None):
+        """ register or update a live device report
+
+        Args:
+            device_id (str): the reported device
+            signals (dict): signal name -> value, eg. {"host": "10.0.0.2"}
+            scanner (str): plugin that reported the device
+        Returns:
+            int: number of groups merged into the device group
+        """
+        with self.lock:
+            if device_id not in self._parent:
+                self._parent[device_id] = device_id
+                self._members[device_id] = {device_id}
+                self._live[device_id] = 0
+                self._first_seen[device_id] = (next(self._seq), device_id)
+                self._canonical[device_id] = self._first_seen[device_id]
+            if device_id not in self._alive:
+                self._alive.add(device_id)
+                self._live[self._find(device_id)] += 1
+            keys = self._keys.setdefault(device_id, [])
+            current = {(signal, value) for signal, value in signals.items()
+                       if signal in self.signals and value}
+            stale = [k for k in keys if k[2] == scanner and k[:2] not in current]
+            for signal, value, _ in stale:
+                keys.remove((signal, value, scanner))
+                self._release(device_id, (signal, value), scanner)
+            merged = 0
+            for key in current:
+                merged += self._claim(device_id, key, scanner)
+                if key + (scanner,) not in keys:
+                    keys.append(key + (scanner,))
+            if stale:
+                self._regroup(self._find(device_id))
+            return merged
+
+    def _claim(self, device_id, key, scanner):
+        # register device_id as reporting key, returns number of merges
+        if key[0] in STRONG_SIGNALS:
+            return int(self._union(device_id, self._strong.setdefault(key, device_id)))
+        merged = 0
+        owners = self._weak.setdefault(key, {})
+        ids = owners.setdefault(scanner, set())
+        ids.add(device_id)
+        if len(ids) == 1:
+            for other_scanner, others in owners.items():
+                if other_scanner != scanner and len(others) == 1:
+                    merged += self._union(device_id, next(iter(others)))
+        return merged
+
+    def _release(self, device_id, key, scanner):
+        # device_id no longer reports key
+        if key[0] in STRONG_SIGNALS:
+            if self._strong.get(key) == device_id:
+                self._strong.pop(key)
+                # handed over to a device still reporting it, any such
+                # device was merged into the same group
+                for other in self._members.get(self._find(device_id), ()):
+                    if other != device_id and \
+                            any(k[:2] == key for k in self._keys.get(other, ())):
+                        self._strong[key] = other
+                        break
+            return
+        owners = self._weak.get(key)
+        if owners is None:
+            return
+        ids = owners.get(scanner, set())
+        ids.discard(device_id)
+        if not ids:
+            owners.pop(scanner, None)
+        if not owners:
+            self._weak.pop(key)
+
+    def _regroup(self, root):
+        # split a group into the groups its members' current signals
+        # justify, union-find can not undo a single merge
+        members = self._members.pop(root)
+        self._live.pop(root)
+        self._canonical.pop(root)
+        for member in members:
+            self._parent[member] = member
+            self._members[member] = {member}
+            self._live[member] = int(member in self._alive)
+            self._canonical[member] = self._first_seen[member]
+        strong = {}
+        for member in members:
+            for signal, value, scanner in self._keys.get(member, []):
+                key = (signal, value)
+                if signal in STRONG_SIGNALS:
+                    self._union(member, strong.setdefault(key, member))
+                    continue
+                owners = self._weak.get(key, {})
+                if len(owners.get(scanner, ())) != 1:
+                    continue
+                for other_scanner, others in owners.items():
+                    if other_scanner != scanner and len(others) == 1:
+                        other = next(iter(others))
+                        if other in members:
+                            self._union(member, other)
+
+    def remove(self, device_id):
+        """ mark a device report as lost, the whole group is pruned
+        once none of its members is alive"""
+        with self.lock:
+            if device_id not in self._alive:
+                return
+            self._alive.discard(device_id)
+            root = self._find(device_id)
+            self._live[root] -= 1
+            if self._live[root] > 0:
+                return
+            members = self._members.pop(root)
+            for member in members:
+                for signal, value, scanner in self._keys.pop(member, []):
+                    self._release(member, (signal, value), scanner)
+            for member in members:
+                self._parent.pop(member)
+                self._first_seen.pop(member)
+            self._live.pop(root)
+            self._canonical.pop(root)
+
+    def canonical_id(self, device_id):
+        """ id of the physical device behind device_id"""
+        with self.lock:
+            if device_id not in self._parent:
+                return device_id
+            return self._canonical[self._find(device_id)][1]
+
+    def group(self, device_id):
+        """ live device_ids reported for the same physical device"""
+        with self.lock:
+            if device_id not in self._parent:
+                return []
+            return sorted(d for d in self._members[self._find(device_id)]
+                          if d in self._alive)
+
+    def groups(self):
+        """ canonical id -> live device_ids, for physical devices
+        reported more than once"""
+        with self.lock:
+            groups = {}
+            for root, members in self._members.items():
+                live = sorted(d for d in members if d in self._alive)
+                if len(live) > 1:
+                    groups[self._canonical[root][1]] = live
+            return groups
@@ -0,0 +1,161 @@
+import multiprocessing
+import pickle
+import time
+from importlib import import_module
+from threading import Lock
+
+from ovos_utils.log import LOG
+from ovos_utils.messagebus import FakeBus
+
+from ovos_PHAL_plugin_commonIOT.opm.base import IOTScannerPlugin, IOTAsyncScannerPlugin
+from ovos_PHAL_plugin_commonIOT.registry import device_from_record
+
+
+def can_isolate(scanner_clazz):
+    """ only plugins driven by scan()/ascan() can run in a worker process,
+    plugins with their own run loop, delta or push only plugins can not"""
+    if scanner_clazz.run not in (IOTScannerPlugin.run, IOTAsyncScannerPlugin.run):
+        return False
+    if scanner_clazz.scan_delta is not IOTScannerPlugin.scan_delta:
+        return False
+    if issubclass(scanner_clazz, IOTAsyncScannerPlugin):
+        return scanner_clazz.ascan is not IOTAsyncScannerPlugin.ascan
+    return scanner_clazz.scan is not IOTScannerPlugin.scan
+
+
+def _pack(devices):
+    # whole list in one go, devices holding unpicklable handles
+    # (sockets, locks) are sent as as_record dicts instead
+    try:
+        return pickle.dumps(devices, pickle.HIGHEST_PROTOCOL)
+    except Exception:
+        packed = []
+        for device in devices:
+            try:
+                pickle.dumps(device, pickle.HIGHEST_PROTOCOL)
+                packed.append(device)
+            except Exception:
+                packed.append(device.as_record())
+        return pickle.dumps(packed, pickle.HIGHEST_PROTOCOL)
+
+
+def _unpack(data):
+    devices = []
+    for device in pickle.loads(data):
+        if isinstance(device, dict):
+            device = device_from_record(device)
+            device._provisional = False
+        devices.append(device)
+    return devices
+
+
+def _worker_main(module, qualname, kwargs, conn):
+    """ worker process entry point, scans whenever the parent asks"""
+    try:
+        scanner_clazz = getattr(import_module(module), qualname)
+        scanner = scanner_clazz(FakeBus(), **kwargs)
+    except Exception as e:
+        conn.send(("error", f"failed to load: {e}"))
+        return
+    conn.send(("ready", None))
+    while True:
+        try:
+            command = conn.recv()
+        except (EOFError, OSError):
+            return  # parent is gone
+        if command != "scan":
+            return
+        try:
+            conn.send_bytes(b"D" + _pack(list(scanner.scan())))
+        except Exception as e:
+            conn.send_bytes(b"E" + str(e).encode("utf-8"))
+
+
+class IsolatedScanner(IOTScannerPlugin):
+    """ proxy for a scanner plugin running in a worker process
+
+    the plugin scans in its own interpreter, so CPU heavy parsing or a C
+    extension holding the GIL can not stall the rest of PHAL. Scan results
+    come back pickled over a pipe and are handled by this proxy like any
+    other scan. A worker that crashes, or does not answer within
+    isolated_scan_timeout seconds, is killed and restarted on the next scan"""
+
+    def __init__(self, scanner_clazz, bus=None, name="", config=None,
+                 new_device_callback=None, lost_device_callback=None,
+                 aliases=None):
+        super().__init__(bus, name, config, new_device_callback,
+                         lost_device_callback, aliases)
+        self.scanner_clazz = scanner_clazz
+        # constructor arguments for the plugin inside the worker
+        self.worker_kwargs = {}
+        if config is not None:
+            self.worker_kwargs["config"] = config
+        if aliases is not None:
+            self.worker_kwargs["aliases"] = aliases
+        self.start_timeout = self.config.get("isolated_start_timeout", 60)
+        self.scan_timeout = self.config.get("isolated_scan_timeout", 60)
+        self._mp = multiprocessing.get_context("spawn")
+        self._process = None
+        self._conn = None
+        self._lock = Lock()
+        self._started = False
+        self.restarts = 0
+
+    def _start_worker(self):
+        parent_conn, child_conn = self._mp.Pipe()
+        self._process = self._mp.Process(
+            target=_worker_main,
+            args=(self.scanner_clazz.__module__, self.scanner_clazz.__qualname__,
+                  self.worker_kwargs, child_conn),
+            name=f"iot-{self.name}", daemon=True)
+        self._process.start()
+        child_conn.close()
+        self._conn = parent_conn
+        if not self._conn.poll(self.start_timeout):
+            raise TimeoutError(f"{self.name} worker did not start")
+        status, error = self._conn.recv()
+        if status != "ready":
+            raise RuntimeError(error)
+
+    def stop_worker(self):
+        with self._lock:
+            self._stop_worker()
+
+    def _stop_worker(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+        if self._process is not None:
+            if self._process.is_alive():
+                self._process.kill()
+                self._process.join(1)
+            self._process = None
+
+    def scan(self):
+        with self._lock:
+            if self._process is not None and not self._process.is_alive():
+                LOG.error(f"{self.name} worker died "
+                          f"(exit code {self._process.exitcode}), restarting")
+                self._stop_worker()
+            try:
+                if self._process is None:
+                    if self._started:
+                        self.restarts += 1
+                        self.metrics.incr(f"scanner.{self.name}.restarts")
+                    self._started = True
+                    start = time.monotonic()
+                    self._start_worker()
+                    self.metrics.observe(f"scanner.{self.name}.worker_start",
+                                         time.monotonic() - start)
+                self._conn.send("scan")
+                if not self._conn.poll(self.scan_timeout):
+                    raise TimeoutError(f"{self.name} worker did not answer "
+                                       f"within {self.scan_timeout} seconds")
+                data = self._conn.recv_bytes()
+            except Exception:
+                # crashed, hung or failed to start, restarted on the next scan
+                self._stop_worker()
+                raise
+        if data[:1] == b"E":
+            raise RuntimeError(data[1:].decode("utf-8"))
+        return _unpack(data[1:])
@@ -0,0 +1,76 @@
+import time
+from collections import deque
+
+
+class Histogram:
+    """ latest samples in a fixed size ring buffer, statistics are only
+    computed when the histogram is read"""
+    __slots__ = ("samples", "count", "total")
+
+    def __init__(self, size=256):
+        self.samples = deque(maxlen=size)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value):
+        self.samples.append(value)
+        self.count += 1
+        self.total += value
+
+    def summary(self):
+        samples = sorted(self.samples)
+        if not samples:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "mean": self.total / self.count,
+            "min": samples[0],
+            "max": samples[-1],
+            "p50": samples[len(samples) // 2],
+            "p95": samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+        }
+
+
+class IOTMetrics:
+    """ counters and latency histograms for the commonIOT hot paths
+
+    recording is a dict lookup plus an append, nothing is aggregated
+    until summary() is called. Updates are not locked, under heavy
+    concurrency a counter may occasionally miss an increment"""
+
+    def __init__(self, size=256):
+        self.size = size
+        self.enabled = True
+        self.started = time.time()
+        self.counters = {}
+        self.histograms = {}
+
+    def incr(self, name, value=1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, value):
+        if not self.enabled:
+            return
+        hist = self.histograms.get(name)
+        if hist is None:
+            hist = self.histograms[name] = Histogram(self.size)
+        hist.observe(value)
+
+    def reset(self):
+        self.started = time.time()
+        self.counters = {}
+        self.histograms = {}
+
+    def summary(self):
+        uptime = time.time() - self.started
+        return {
+            "uptime": uptime,
+            "counters": dict(self.counters),
+            "rates": {k: v / uptime for k, v in self.counters.items()} if uptime else {},
+            "histograms": {k: h.summary() for k, h in list(self.histograms.items())}
+        }
+
+
+# shared by scanners, devices and the device manager
+METRICS = IOTMetrics()
@@ -0,0 +1,147 @@
+import heapq
+import itertools
+import re
+from collections import Counter, defaultdict
+from operator import itemgetter
+from threading import Lock
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+# dropped from names and queries, "the kitchen lamp" == "kitchen lamp"
+STOPWORDS = {"the", "a", "an", "my"}
+
+
+def normalize(text):
+    """ lowercase words without punctuation or stopwords"""
+    return [w for w in _PUNCTUATION.sub(" ", str(text).lower()).split()
+            if w not in STOPWORDS]
+
+
+def trigrams(word):
+    padded = f" {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class DeviceNameIndex:
+    """ fuzzy spoken phrase -> device_id lookups
+
+    every device is indexed under one or more phrases (name, area + name,
+    aliases). Query words are matched against the vocabulary of known words,
+    exactly or through a trigram index for misheard words, and only phrases
+    containing the rarest matched words are scored, instead of fuzzy
+    matching every known device"""
+
+    def __init__(self, max_candidates=64, word_min_score=0.5):
+        self.max_candidates = max_candidates
+        self.word_min_score = word_min_score
+        self._entries = {}  # entry id -> (device_id, words)
+        self._device_entries = {}  # device_id -> [entry ids]
+        self._word_entries = defaultdict(set)  # word -> entry ids
+        self._word_grams = defaultdict(set)  # trigram -> known words
+        self._gram_counts = {}  # known word -> number of trigrams
+        self._ids = itertools.count()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._device_entries)
+
+    def __contains__(self, device_id):
+        return device_id in self._device_entries
+
+    def add(self, device_id, phrases):
+        """ index device_id under phrases, replacing previous phrases"""
+        with self._lock:
+            self._remove(device_id)
+            entries = self._device_entries[device_id] = []
+            for words in {tuple(normalize(p)) for p in phrases if p}:
+                if not words:
+                    continue
+                entry_id = next(self._ids)
+                self._entries[entry_id] = (device_id, words)
+                for word in words:
+                    if word not in self._word_entries:
+                        grams = trigrams(word)
+                        for gram in grams:
+                            self._word_grams[gram].add(word)
+                        self._gram_counts[word] = len(grams)
+                    self._word_entries[word].add(entry_id)
+                entries.append(entry_id)
+
+    def remove(self, device_id):
+        with self._lock:
+            self._remove(device_id)
+
+    def _remove(self, device_id):
+        for entry_id in self._device_entries.pop(device_id, []):
+            _, words = self._entries.pop(entry_id)
+            for word in words:
+                ids = self._word_entries.get(word)
+                if ids is None:
+                    continue
+                ids.discard(entry_id)
+                if ids:
+                    continue
+                self._word_entries.pop(word)
+                self._gram_counts.pop(word, None)
+                for gram in trigrams(word):
+                    known = self._word_grams.get(gram)
+                    if known is not None:
+                        known.discard(word)
+                        if not known:
+                            self._word_grams.pop(gram)
+
+    def _match_word(self, word):
+        """ known words similar to word -> dice coefficient of their trigrams"""
+        if word in self._word_entries:
+            return {word: 1.0}
+        grams = trigrams(word)
+        shared = Counter()
+        for gram in grams:
+            known = self._word_grams.get(gram)
+            if known:
+                shared.update(known)
+        matches = {}
+        for known, count in shared.items():
+            score = 2 * count / (len(grams) + self._gram_counts[known])
+            if score >= self.word_min_score:
+                matches[known] = score
+        return matches
+
+    def lookup(self, text, k=5, min_score=0.3):
+        """ best matching devices for a spoken phrase
+
+        the score is the dice coefficient of query and phrase words, where
+        misheard words count by their trigram similarity, 1.0 is an exact
+        match after normalization
+
+        Returns:
+            list: up to k (device_id, score) tuples, best first
+        """
+        query = normalize(text)
+        if not query:
+            return []
+        with self._lock:
+            # known word -> [(query word position, similarity)]
+            hits = defaultdict(list)
+            for idx, word in enumerate(query):
+                for known, similarity in self._match_word(word).items():
+                    hits[known].append((idx, similarity))
+            # collect candidates from the rarest words first, very common
+            # words ("light", "lamp") only matter when nothing rarer matched
+            postings = sorted((self._word_entries[w] for w in hits), key=len)
+            candidates = set()
+            for ids in postings:
+                if candidates and len(candidates) + len(ids) > self.max_candidates:
+                    break
+                candidates.update(ids)
+            best = {}
+            for entry_id in candidates:
+                device_id, words = self._entries[entry_id]
+                matched = {}  # query word position -> best similarity
+                for word in words:
+                    for idx, similarity in hits.get(word, ()):
+                        if similarity > matched.get(idx, 0):
+                            matched[idx] = similarity
+                score = 2 * sum(matched.values()) / (len(query) + len(words))
+                if score >= min_score and score > best.get(device_id, 0):
+                    best[device_id] = score
+        return heapq.nlargest(k, best.items(), key=itemgetter(1))
@@ -1,3 +1,5 @@
+from importlib.metadata import entry_points
+
 from ovos_plugin_manager.utils import load_plugin, find_plugins
 import enum
 
@@ -11,6 +13,19 @@ def find_iot_plugins():
     return find_plugins(PluginTypes.IOT)
 
 
+def find_iot_plugin_entry_points():
+    """ iot plugin entry points, without importing the plugins
+    Returns:
+        dict: plugin name -> importlib EntryPoint
+    """
+    eps = entry_points()
+    if hasattr(eps, "select"):  # python 3.10+
+        eps = eps.select(group=PluginTypes.IOT.value)
+    else:
+        eps = eps.get(PluginTypes.IOT.value, [])
+    return {ep.name: ep for ep in eps}
+
+
 def load_iot_plugin(module_name):
     """Wrapper function for loading iot plugin.
     Arguments:
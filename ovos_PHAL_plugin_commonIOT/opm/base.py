@@ -1,13 +1,21 @@
+import asyncio
 import enum
+import functools
+import heapq
+import queue
 import time
-from threading import Thread
-from time import sleep
+from threading import Thread, Event
 
 from ovos_config import Configuration
 from ovos_utils import camel_case_split
 from ovos_utils.log import LOG
 from ovos_utils.messagebus import get_mycroft_bus
 
+from ovos_PHAL_plugin_commonIOT.metrics import METRICS
+from ovos_PHAL_plugin_commonIOT.opm.commands import DeviceCommandQueue
+from ovos_PHAL_plugin_commonIOT.opm.ratelimit import rate_limited
+from ovos_PHAL_plugin_commonIOT.opm.recording import ScanRecorder
+
 
 class IOTDeviceType(str, enum.Enum):
     """ recognized device types handled by commonIOT"""
@@ -47,6 +55,59 @@ class IOTCapabilties(enum.Enum):
     PREV_PLAYBACK = enum.auto()
 
 
+def capability_mask(capabilities):
+    """ bitmask of IOTCapabilties, bit n is set for the capability with value n"""
+    mask = 0
+    for capability in capabilities:
+        mask |= 1 << capability.value
+    return mask
+
+
+def _cached_state(name, fget):
+    # property getter answered from the device state cache within state_ttl
+    @functools.wraps(fget)
+    def get(self):
+        cache = self._state_cache
+        if cache is not None:
+            entry = cache.get(name)
+            if entry is not None and entry[1] > time.monotonic():
+                return entry[0]
+        value = fget(self)
+        self.remember_state(name, value)
+        return value
+
+    get.state_cached = True
+    return get
+
+
+def _optimistic_state(update, action):
+    # device action that updates the state cache once the device accepted it
+    @functools.wraps(action)
+    def wrapper(self, *args, **kwargs):
+        try:
+            result = action(self, *args, **kwargs)
+        except Exception:
+            self.invalidate_state()  # unknown after a failed command
+            raise
+        for name, value in update(*args, **kwargs).items():
+            if value is None:
+                self.invalidate_state(name)
+            else:
+                self.remember_state(name, value)
+        self.state_changed()
+        return result
+
+    wrapper.state_cached = True
+    return wrapper
+
+
+class IOTScanEvent(str, enum.Enum):
+    """ incremental scan events, see IOTScannerPlugin.scan_delta"""
+    ADDED = "added"
+    UPDATED = "updated"
+    REMOVED = "removed"
+
+
 class IOTScannerPlugin(Thread):
     """ this class is loaded by CommonIOT and yields IOTDevices"""
 
@@ -60,37 +121,348 @@ class IOTScannerPlugin(Thread):
         self.config = config or {}
         self.bus = bus or get_mycroft_bus()
         self.log = LOG
+        self.metrics = METRICS
         self.name = name
         self.new_device_callback = new_device_callback
         self.lost_device_callback = lost_device_callback
+        # UPDATED events for known devices, new_device_callback if not set
+        self.updated_device_callback = None
         self.timestamps = {}
+        # min-heap of (expiry time, device_id), one live entry per device
+        self._expiry = []
+        self._deadlines = {}
         self.aliases = aliases or {}
-        self.ttl = 30  # if not seen for 30 seconds, consider device lost
-        self.time_between_checks = 3  # seconds between scans
+        # if not seen for ttl seconds, consider device lost
+        self.ttl = self.config.get("ttl", 30)
+        # seconds between scans
+        self.time_between_checks = self.config.get("time_between_checks", 3)
+
+        # adaptive scheduling, back off while nothing changes and
+        # scan at burst_interval after devices are found/lost
+        self.adaptive_scan = self.config.get("adaptive_scan", False)
+        self.burst_interval = self.config.get("burst_interval", 1)
+        self.burst_scans = self.config.get("burst_scans", 5)
+        self.scan_backoff = self.config.get("scan_backoff", 1.5)
+        # never back off so far that visible devices expire between scans
+        self.max_scan_interval = min(self.config.get("max_scan_interval", 60),
+                                     self.ttl / 2)
+        self._scan_interval = self.time_between_checks
+        self._burst_left = 0
+        self._changes = 0
+        self._last_scan = 0
+        self.first_scan = None  # timestamp of the first handled scan
+
+        # push discovery, see report_device
+        self._events = queue.Queue(self.config.get("push_queue_size", 1000))
+        self.push_batch_size = self.config.get("push_batch_size", 100)
+        self._drain_pending = False
+
+        self._wake = Event()
+        self.wakeup_callback = None  # set by the scan scheduler
+
+        # timestamps for last_seen and ttl, replaced when replaying recordings
+        self.clock = time.time
+        # log every scan result to a NDJSON file, see opm.recording
+        self.recorder = None
+        if self.config.get("record_path"):
+            self.recorder = ScanRecorder(self.config["record_path"], self.name)
 
     def run(self):
         while True:
-            for dev in self.scan():
-                dev._raw["last_seen"] = time.time()
-                if dev.device_id not in self.timestamps:
-                    print(f"found device: {dev.device_id}")
-                    if self.new_device_callback:
-                        self.new_device_callback(dev)
-                self.timestamps[dev.device_id] = dev  # update last seen
-
-            for device_id, dev in dict(self.timestamps).items():
-                if time.time() - dev.raw_data.get("last_seen", 0) > self.ttl:
-                    # based on last_seen timestamp
-                    print(f"lost device: {device_id}")
-                    self.timestamps.pop(device_id)
-                    if self.lost_device_callback:
-                        self.lost_device_callback(dev)
-
-            sleep(self.time_between_checks)
+            if self.supports_scan and time.time() >= self.next_scan_time:
+                start = time.monotonic()
+                if self.supports_delta:
+                    results = list(self.scan_delta())
+                    self.record_scan_duration(time.monotonic() - start)
+                    self.handle_scan_delta(results)
+                else:
+                    results = list(self.scan())
+                    self.record_scan_duration(time.monotonic() - start)
+                    self.handle_scan_results(results)
+            while self.drain_events():
+                pass
+            self.check_lost_devices()
+            # wake up for whatever comes first, next scan, next expiry
+            # or a pushed event
+            self._wake.wait(self.next_wakeup_delay())
+            self._wake.clear()
+
+    def next_wakeup_delay(self):
+        """ seconds until the next scan or expiry, None if neither is due"""
+        due = [t for t in (self.next_scan_time if self.supports_scan else None,
+                           self.next_expiry) if t is not None]
+        if not due:
+            return None
+        return max(0, min(due) - time.time())
+
+    @property
+    def scan_interval(self):
+        """ seconds to wait after the last scan before scanning again"""
+        if self._burst_left > 0:
+            return self.burst_interval
+        if self.adaptive_scan:
+            return self._scan_interval
+        return self.time_between_checks
+
+    @property
+    def next_scan_time(self):
+        return self._last_scan + self.scan_interval
+
+    def request_burst(self):
+        """ scan at burst_interval for the next burst_scans scans"""
+        self._burst_left = self.burst_scans
+        self.wakeup()
+
+    def wakeup(self):
+        """ interrupt the current wait so the scan schedule is re-evaluated"""
+        self._wake.set()
+        if self.wakeup_callback:
+            self.wakeup_callback()
+
+    def update_scan_interval(self, changed):
+        """ called after every scan, backs off the adaptive interval
+        while scans keep returning no changes"""
+        if self._burst_left > 0:
+            self._burst_left -= 1
+        if not self.adaptive_scan:
+            return
+        if changed:
+            self._scan_interval = self.time_between_checks
+            self.request_burst()
+        elif self._burst_left == 0:
+            self._scan_interval = min(self._scan_interval * self.scan_backoff,
+                                      self.max_scan_interval)
+
+    def record_scan_duration(self, seconds):
+        self.metrics.observe(f"scanner.{self.name}.scan_duration", seconds)
+
+    @property
+    def next_expiry(self):
+        """ timestamp when the next device might be considered lost"""
+        if self._expiry:
+            return self._expiry[0][0]
+        return None
+
+    def handle_scan_results(self, devices):
+        """ register the devices returned by a scan, updating last seen
+        timestamps and emitting new device events"""
+        now = self._last_scan = self.clock()
+        if self.first_scan is None:
+            self.first_scan = now
+        if self.recorder is not None:
+            devices = list(devices)
+            self.recorder.record("scan", now, devices)
+        count = 0
+        for dev in devices:
+            count += 1
+            dev.last_seen = now
+            if self._is_new(dev.device_id):
+                self._schedule_expiry(dev.device_id, now + self.ttl)
+                self._device_found(dev)
+            self.timestamps[dev.device_id] = dev  # update last seen
+        self.metrics.observe(f"scanner.{self.name}.devices", count)
+        # device losses since the previous scan also count as changes
+        self.update_scan_interval(self._changes > 0)
+        self._changes = 0
+
+    def handle_scan_delta(self, events):
+        """ apply (IOTScanEvent, device) tuples returned by scan_delta
+
+        only changed devices are touched, devices reported by a delta scan
+        are present until removed and are not subject to self.ttl"""
+        now = self._last_scan = self.clock()
+        if self.first_scan is None:
+            self.first_scan = now
+        if self.recorder is not None:
+            events = list(events)
+            self.recorder.record("delta", now, events)
+        for event, dev in events:
+            if event == IOTScanEvent.REMOVED:
+                if dev.device_id in self.timestamps:
+                    self._device_lost(dev.device_id)
+                continue
+            dev.last_seen = now
+            if self._is_new(dev.device_id):
+                # delta devices are not subject to ttl, drop any
+                # expiry left over from adopt_devices
+                self._deadlines.pop(dev.device_id, None)
+                self._device_found(dev)
+            elif event == IOTScanEvent.UPDATED:
+                self._device_updated(dev)
+            self.timestamps[dev.device_id] = dev
+        self.update_scan_interval(self._changes > 0)
+        self._changes = 0
+
+    def report_device(self, event, device, block=False, timeout=None):
+        """ push a device event as it happens, eg. from an mDNS, SSDP, MQTT
+        or BLE callback, instead of waiting for the next scan
+
+        events are queued and applied in batches by the scan loop, pushed
+        devices are lost after ttl unless reported again or removed.
+        When the queue is full the event is dropped, unless block is True,
+        then the caller waits up to timeout seconds for room
+
+        Args:
+            event (IOTScanEvent): ADDED/UPDATED (seen) or REMOVED
+            device (IOTAbstractDevice): the device
+        Returns:
+            bool: False if the event was dropped
+        """
+        try:
+            self._events.put((event, device, time.monotonic()), block, timeout)
+        except queue.Full:
+            self.metrics.incr(f"scanner.{self.name}.push_dropped")
+            return False
+        # one wakeup per batch, cleared when a drain starts
+        if not self._drain_pending:
+            self._drain_pending = True
+            self.wakeup()
+        return True
+
+    @property
+    def pending_events(self):
+        return self._events.qsize()
+
+    def drain_events(self):
+        """ apply up to push_batch_size pushed events, must run in the
+        thread that handles scan results
+
+        Returns:
+            bool: True if more events are waiting
+        """
+        self._drain_pending = False
+        batch = []
+        try:
+            while len(batch) < self.push_batch_size:
+                batch.append(self._events.get_nowait())
+        except queue.Empty:
+            pass
+        if batch:
+            self.metrics.observe(f"scanner.{self.name}.push_batch", len(batch))
+            self.metrics.observe(f"scanner.{self.name}.push_latency",
+                                 time.monotonic() - batch[0][2])
+            self.handle_pushed_events((event, dev) for event, dev, _ in batch)
+        return not self._events.empty()
+
+    def handle_pushed_events(self, events):
+        """ apply (IOTScanEvent, device) tuples passed to report_device"""
+        now = self.clock()
+        if self.recorder is not None:
+            events = list(events)
+            self.recorder.record("push", now, events)
+        changes = self._changes  # pushes do not change the scan schedule
+        for event, dev in events:
+            if event == IOTScanEvent.REMOVED:
+                if dev.device_id in self.timestamps:
+                    self._device_lost(dev.device_id)
+                continue
+            dev.last_seen = now
+            if self._is_new(dev.device_id):
+                self._schedule_expiry(dev.device_id, now + self.ttl)
+                self._device_found(dev)
+            elif event == IOTScanEvent.UPDATED:
+                self._device_updated(dev)
+            self.timestamps[dev.device_id] = dev
+        self._changes = changes
+
+    def _is_new(self, device_id):
+        # provisional devices restored from disk are announced again
+        # when a scan confirms them, replacing the placeholder object
+        dev = self.timestamps.get(device_id)
+        return dev is None or dev._provisional
+
+    def adopt_devices(self, devices):
+        """ track devices restored from a previous run (see
+        IOTAbstractDevice.from_record), they are reported lost
+        unless a scan confirms them within ttl"""
+        now = self.clock()
+        for dev in devices:
+            if dev.device_id in self.timestamps:
+                continue
+            dev.last_seen = now
+            self.timestamps[dev.device_id] = dev
+            self._schedule_expiry(dev.device_id, now + self.ttl)
+
+    def _device_found(self, dev):
+        self._changes += 1
+        self.metrics.incr(f"scanner.{self.name}.found")
+        if self.new_device_callback:
+            start = time.monotonic()
+            self.new_device_callback(dev)
+            self.metrics.observe(f"scanner.{self.name}.callback_duration",
+                                 time.monotonic() - start)
+
+    def _device_updated(self, dev):
+        self.metrics.incr(f"scanner.{self.name}.updated")
+        callback = self.updated_device_callback or self.new_device_callback
+        if callback:
+            start = time.monotonic()
+            callback(dev)
+            self.metrics.observe(f"scanner.{self.name}.callback_duration",
+                                 time.monotonic() - start)
+
+    def _device_lost(self, device_id):
+        dev = self.timestamps.pop(device_id)
+        self._deadlines.pop(device_id, None)
+        self._changes += 1
+        self.metrics.incr(f"scanner.{self.name}.lost")
+        if self.lost_device_callback:
+            start = time.monotonic()
+            self.lost_device_callback(dev)
+            self.metrics.observe(f"scanner.{self.name}.callback_duration",
+                                 time.monotonic() - start)
+
+    def _schedule_expiry(self, device_id, deadline):
+        self._deadlines[device_id] = deadline
+        heapq.heappush(self._expiry, (deadline, device_id))
+
+    def check_lost_devices(self):
+        """ emit lost device events for devices not seen within self.ttl
+
+        only heap entries that are due are inspected, devices seen again
+        since their entry was scheduled get rescheduled instead"""
+        now = self.clock()
+        while self._expiry and self._expiry[0][0] <= now:
+            deadline, device_id = heapq.heappop(self._expiry)
+            if self._deadlines.get(device_id) != deadline:
+                continue  # stale entry
+            dev = self.timestamps[device_id]
+            expires = (dev.last_seen or 0) + self.ttl
+            if expires > now:
+                # seen again since scheduled, based on last_seen timestamp
+                self._schedule_expiry(device_id, expires)
+                continue
+            self._device_lost(device_id)
+
+    @property
+    def overrides_run(self):
+        """ True if a subclass implements its own run loop,
+        such plugins can not be driven by the shared scan scheduler"""
+        return type(self).run is not IOTScannerPlugin.run and \
+            type(self).run is not IOTAsyncScannerPlugin.run
+
+    @property
+    def supports_scan(self):
+        """ False for push only plugins, see report_device"""
+        return self.supports_delta or type(self).scan is not IOTScannerPlugin.scan
+
+    @property
+    def supports_delta(self):
+        """ True if the plugin implements the incremental scan_delta protocol"""
+        return type(self).scan_delta is not IOTScannerPlugin.scan_delta
 
     def scan(self):
         raise NotImplemented("scan method must be implemented by subclasses")
 
+    def scan_delta(self):
+        """ optional incremental alternative to scan
+
+        yield (IOTScanEvent, IOTAbstractDevice) tuples for the devices
+        added, updated or removed since the previous call, unchanged
+        devices are not reported. Plugins that do not implement this
+        use the full snapshot returned by scan"""
+        raise NotImplementedError
+
     def get_device(self, ip):
         for device in self.scan():
             if device.host == ip:
@@ -98,8 +470,99 @@ class IOTScannerPlugin(Thread):
         return None
 
 
+class IOTAsyncScannerPlugin(IOTScannerPlugin):
+    """ asyncio based scanner, ascan is awaited by the shared scan scheduler
+    instead of running the blocking scan method in a worker thread"""
+
+    def run(self):
+        asyncio.run(self._arun())
+
+    async def _arun(self):
+        loop = asyncio.get_running_loop()
+        wake = asyncio.Event()
+        self.wakeup_callback = lambda: loop.call_soon_threadsafe(wake.set)
+        while True:
+            if self.supports_scan and time.time() >= self.next_scan_time:
+                start = time.monotonic()
+                results = await self.ascan()
+                self.record_scan_duration(time.monotonic() - start)
+                self.handle_scan_results(results)
+            while self.drain_events():
+                await asyncio.sleep(0)
+            self.check_lost_devices()
+            try:
+                await asyncio.wait_for(wake.wait(), self.next_wakeup_delay())
+            except asyncio.TimeoutError:
+                pass
+            wake.clear()
+
+    @property
+    def supports_scan(self):
+        return type(self).ascan is not IOTAsyncScannerPlugin.ascan
+
+    async def ascan(self):
+        """ return a list of IOTAbstractDevice currently visible"""
+        raise NotImplementedError("ascan method must be implemented by subclasses")
+
+    def scan(self):
+        # blocking compatibility wrapper, eg. for get_device
+        return asyncio.run(self.ascan())
+
+
 class IOTAbstractDevice:
+    # scanners may create a new object per advertisement, keep them compact,
+    # subclasses should declare __slots__ = () unless they need extra state
+    __slots__ = ("_device_type", "_device_id", "_name", "_host", "_area",
+                 "_raw", "mode", "_timer", "_commands", "_dict_cache",
+                 "last_seen", "_provisional", "_state_cache", "state_ttl",
+                 "state_listener")
     capabilities = []
+    capability_mask = 0  # precomputed per class from capabilities
+    command_interval = 0.1  # min seconds between queued commands
+    # properties that usually mean a network round trip, reads within
+    # state_ttl seconds are answered from the state cache
+    cached_states = ("is_on",)
+    default_state_ttl = 2.0
+    # action -> function(*args, **kwargs) returning the expected new state,
+    # applied once the action succeeded, None values are forgotten instead
+    state_updates = {}
+    # methods that send a command to the device, they wait for a token of
+    # the per host rate limiter, see opm.ratelimit
+    rate_limited_actions = ("turn_on", "turn_off", "toggle", "reset",
+                            "change_color", "change_color_rgb", "change_color_hex",
+                            "change_color_hsv", "random_color", "change_brightness",
+                            "set_low_brightness", "set_high_brightness",
+                            "resume", "stop", "pause", "play_next", "play_prev",
+                            "sleep", "wakeup", "reboot", "get_picture",
+                            "get_volume", "set_volume", "volume_up", "volume_down",
+                            "mute", "unmute")
+    # methods bus clients may call by name, anything else is rejected,
+    # see CommonIOTDeviceManager.call_device
+    bus_actions = rate_limited_actions
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if isinstance(cls.capabilities, (list, tuple, set, frozenset)):
+            cls.capability_mask = capability_mask(cls.capabilities)
+        else:
+            # capabilities decided per instance, see has_capability
+            cls.capability_mask = None
+        # plugins override the state properties and actions, wrap
+        # every implementation so they all go through the state cache
+        for name in cls.cached_states:
+            prop = cls.__dict__.get(name)
+            if isinstance(prop, property) and prop.fget is not None and \
+                    not getattr(prop.fget, "state_cached", False):
+                setattr(cls, name, property(_cached_state(name, prop.fget),
+                                            prop.fset, prop.fdel, prop.__doc__))
+        for name, update in cls.state_updates.items():
+            action = cls.__dict__.get(name)
+            if callable(action) and not getattr(action, "state_cached", False):
+                setattr(cls, name, _optimistic_state(update, action))
+        for name in cls.rate_limited_actions:
+            action = cls.__dict__.get(name)
+            if callable(action) and not getattr(action, "rate_limited", False):
+                setattr(cls, name, rate_limited(action))
 
     def __init__(self, device_id, host=None, name="abstract_device",
                  area=None, device_type=IOTDeviceType.SENSOR, raw_data=None):
@@ -109,14 +572,134 @@ class IOTAbstractDevice:
         self._name = name or self.__class__.__name__
         self._host = host
         self._area = area
-        self._raw = raw_data or {
-            "name": name, "host": host,
-            "area": area, "device_id": device_id}
+        self._raw = raw_data  # plugin data only, created on first access
         self.mode = ""
         self._timer = None
+        self._commands = None
+        self._dict_cache = None  # (state, as_dict)
+        self.last_seen = None  # set by the scanner tracking this device
+        self._provisional = False
+        self._state_cache = None  # state name -> (value, expires)
+        self.state_ttl = self.default_state_ttl
+        # called with the device when a command or read changes its state
+        self.state_listener = None
+
+    @property
+    def commands(self):
+        """ DeviceCommandQueue used by submit, created on first use"""
+        if self._commands is None:
+            self._commands = DeviceCommandQueue(self, self.command_interval)
+        return self._commands
+
+    def submit(self, action, *args, **kwargs):
+        """ queue a command by method name, superseded commands are merged
+        and commands are rate limited to one per command_interval"""
+        self.commands.submit(action, *args, **kwargs)
+
+    def as_record(self):
+        """ compact json serializable description, see from_record"""
+        return {
+            "device_id": self.device_id,
+            "host": self.host,
+            "name": self.name,
+            "area": self.device_area,
+            "device_type": self.device_type,
+            "module": self.__class__.__module__,
+            "class": self.__class__.__qualname__,
+            "last_seen": self.last_seen
+        }
+
+    @classmethod
+    def from_record(cls, record):
+        """ rebuild a provisional device from as_record output, plugins
+        with different constructor arguments should override this"""
+        try:
+            device_type = IOTDeviceType(record["device_type"])
+        except ValueError:
+            device_type = record["device_type"]
+        device = cls(record["device_id"], host=record.get("host"),
+                     name=record.get("name"), area=record.get("area"),
+                     device_type=device_type)
+        device.last_seen = record.get("last_seen")
+        device._provisional = True
+        return device
+
+    def remember_state(self, name, value):
+        """ cache a state value for state_ttl seconds, the state listener
+        is notified when it differs from the previously known value"""
+        cache = self._state_cache
+        if cache is None:
+            cache = self._state_cache = {}
+        previous = cache.get(name)
+        # kept even with state_ttl <= 0, expired values are never served
+        # but still tell whether the next read changed anything
+        cache[name] = (value, time.monotonic() + self.state_ttl)
+        if previous is not None and previous[0] != value:
+            self.state_changed()
+
+    def state_changed(self):
+        """ plugins receiving state updates from the device should call this"""
+        if self.state_listener is not None:
+            self.state_listener(self)
+
+    def invalidate_state(self, *names):
+        """ forget cached state values, all of them if no names are given"""
+        if not names or self._state_cache is None:
+            self._state_cache = None
+            return
+        for name in names:
+            self._state_cache.pop(name, None)
+
+    def refresh_state(self, *names):
+        """ read state values from the device, bypassing the cache
+
+        Returns:
+            dict: state name -> fresh value
+        """
+        names = names or self.cached_states
+        self.invalidate_state(*names)
+        return {name: getattr(self, name) for name in names}
+
+    def identity_signals(self):
+        """ values identifying the physical device, used to link reports of
+        the same device by different plugins, plugins should report "mac"
+        and "serial" in raw_data or override this when they know them"""
+        raw = self._raw or {}
+        area = self.device_area if isinstance(self.device_area, str) else ""
+        return {
+            "host": self.host,
+            "mac": raw.get("mac"),
+            "serial": raw.get("serial"),
+            "name": f"{area}/{self.name}".lower()
+        }
+
+    def has_capability(self, capability):
+        """ constant time check, unlike capability in self.capabilities"""
+        mask = self.capability_mask
+        if mask is None:
+            mask = capability_mask(self.capabilities)
+        return bool(mask & (1 << capability.value))
+
+    @property
+    def is_provisional(self):
+        """ restored from disk and not yet confirmed by a scan"""
+        return self._provisional
 
     @property
     def as_dict(self):
+        """ cached, only rebuilt when the reported state changes,
+        callers must copy it before modifying"""
+        state = self._dict_state()
+        cache = self._dict_cache
+        if cache is None or cache[0] != state:
+            cache = self._dict_cache = (state, self._build_dict(state))
+        return cache[1]
+
+    def _dict_state(self):
+        # everything in as_dict that may change over the device lifetime
+        return self.is_on
+
+    def _build_dict(self, state):
         return {
             "host": self.host,
             "name": self.name,
@@ -124,12 +707,18 @@ class IOTAbstractDevice:
             "area": self.device_area,
             "device_type": self.device_type,
             "device_class": self.__class__.__name__,
-            "state": self.is_on
+            "state": state
         }
 
+    def invalidate_cache(self):
+        """ plugins must call this if name, host or area change"""
+        self._dict_cache = None
+
     @property
     def device_id(self):
-        return self._device_id or self.raw_data.get("device_id")
+        if not self._device_id and self._raw:
+            return self._raw.get("device_id")
+        return self._device_id
 
     @property
     def device_type(self):
@@ -145,6 +734,8 @@ class IOTAbstractDevice:
 
     @property
     def raw_data(self):
+        if self._raw is None:
+            self._raw = {}
         return self._raw
 
     @property
@@ -174,6 +765,7 @@ class IOTAbstractDevice:
 
 
 class Sensor(IOTAbstractDevice):
+    __slots__ = ()
     capabilities = [
         IOTCapabilties.REPORT_STATUS
     ]
@@ -184,10 +776,15 @@ class Sensor(IOTAbstractDevice):
 
 
 class Switch(Sensor):
+    __slots__ = ()
     capabilities = Sensor.capabilities + [
         IOTCapabilties.TURN_ON,
         IOTCapabilties.TURN_OFF
     ]
+    state_updates = {
+        "turn_on": lambda *args, **kwargs: {"is_on": True},
+        "turn_off": lambda *args, **kwargs: {"is_on": False}
+    }
 
     def __init__(self, device_id, host=None, name="generic_switch",
                  area=None, device_type=IOTDeviceType.SWITCH, raw_data=None):
@@ -218,6 +815,8 @@ class Switch(Sensor):
 class Plug(Switch):
     # Switch is binary, Plug maybe not
     # usually provides power consumption etc,
+    __slots__ = ()
+
     def __init__(self, device_id, host=None, name="generic_plug",
                  area=None, device_type=IOTDeviceType.PLUG, raw_data=None):
         super().__init__(device_id, host, name, area, device_type, raw_data)
@@ -0,0 +1,117 @@
+from functools import lru_cache
+
+from lingua_franca.util.colors import Color
+
+from ovos_PHAL_plugin_commonIOT.opm.transitions import ColorTransition
+
+# parsed colors are cached and shared, Color objects are mutable so every
+# public function returns a copy, compare colors by their rgb255 tuples
+_CACHE_SIZE = 1024
+
+
+def _copy(color):
+    # ~25x faster than building a new Color, _hsl is updated in place
+    # by some colour setters (eg. hue) so it is copied as well
+    clone = object.__new__(type(color))
+    clone.__dict__.update(color.__dict__)
+    clone.__dict__["_hsl"] = list(color._hsl)
+    return clone
+
+
+@lru_cache(maxsize=_CACHE_SIZE)
+def _from_rgb(r, g, b):
+    return Color.from_rgb(r, g, b)
+
+
+@lru_cache(maxsize=_CACHE_SIZE)
+def _from_hex(hexcolor):
+    return Color.from_hex(hexcolor)
+
+
+@lru_cache(maxsize=_CACHE_SIZE)
+def _from_hsv(h, s, v):
+    return Color.from_hsv(h, s, v)
+
+
+@lru_cache(maxsize=_CACHE_SIZE)
+def _from_name(name):
+    return Color(name.strip().lower())
+
+
+def color_from_rgb(r, g, b):
+    return _copy(_from_rgb(r, g, b))
+
+
+def color_from_hex(hexcolor):
+    return _copy(_from_hex(hexcolor))
+
+
+def color_from_hsv(h, s, v):
+    return _copy(_from_hsv(h, s, v))
+
+
+def color_from_name(name):
+    return _copy(_from_name(name))
+
+
+def _resolve(color):
+    # shared cached Color, never returned to callers
+    if isinstance(color, str):
+        if color.startswith("#"):
+            return _from_hex(color)
+        return _from_name(color)
+    r, g, b = color
+    return _from_rgb(r, g, b)
+
+
+def resolve_color(color):
+    """ Color for a Color, color name, hex string or (r, g, b) tuple"""
+    if isinstance(color, Color):
+        return color
+    return _copy(_resolve(color))
+
+
+def resolve_rgb(color):
+    """ (r, g, b) tuple for a Color, color name, hex string or (r, g, b) tuple"""
+    if isinstance(color, Color):
+        return color.rgb255
+    if isinstance(color, tuple) and len(color) == 3:
+        return color
+    return _resolve(color).rgb255
+
+
+def cache_info():
+    """ lru cache statistics per conversion"""
+    return {"color_from_rgb": _from_rgb.cache_info()._asdict(),
+            "color_from_hex": _from_hex.cache_info()._asdict(),
+            "color_from_hsv": _from_hsv.cache_info()._asdict(),
+            "color_from_name": _from_name.cache_info()._asdict()}
+
+
+WHITE = (255, 255, 255)
+BLACK = (0, 0, 0)
+
+# color_cycle effect, in order around the hue circle
+COLOR_WHEEL = (
+    (255, 0, 0),  # red
+    (255, 125, 0),  # orange
+    (255, 255, 0),  # yellow
+    (125, 255, 0),  # spring green
+    (0, 255, 0),  # green
+    (0, 255, 125),  # turquoise
+    (0, 255, 255),  # cyan
+    (0, 125, 255),  # ocean
+    (0, 0, 255),  # blue
+    (125, 0, 255),  # violet
+    (255, 0, 255),  # magenta
+    (255, 0, 125)  # raspberry
+)
+
+
+@lru_cache(maxsize=16)
+def color_wheel_fades(duration=1.0, fps=20, curve="linear"):
+    """ ColorTransition from every COLOR_WHEEL color to the next one,
+    shared by every color_cycle effect with the same settings"""
+    return tuple(ColorTransition(c, COLOR_WHEEL[(i + 1) % len(COLOR_WHEEL)],
+                                 duration=duration, fps=fps, curve=curve)
+                 for i, c in enumerate(COLOR_WHEEL))
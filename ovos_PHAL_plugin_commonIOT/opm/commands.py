@@ -0,0 +1,142 @@
+import heapq
+import itertools
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread, Condition, Lock
+
+from ovos_utils.log import LOG
+
+from ovos_PHAL_plugin_commonIOT.metrics import METRICS
+
+# commands of the same kind supersede each other, last writer wins
+COMMAND_KINDS = {
+    "turn_on": "power",
+    "turn_off": "power",
+    "toggle": "toggle",
+    "change_brightness": "brightness",
+    "set_low_brightness": "brightness",
+    "set_high_brightness": "brightness",
+    "change_color": "color",
+    "change_color_rgb": "color",
+    "change_color_hex": "color",
+    "change_color_hsv": "color",
+    "random_color": "color",
+    "set_volume": "volume"
+}
+_OPPOSITE_POWER = {"turn_on": "turn_off", "turn_off": "turn_on"}
+
+
+class DeviceCommandQueue:
+    """ per device queue that merges superseded commands
+
+    only the latest brightness/color/power/volume command is kept while
+    waiting, two pending toggles cancel out, and commands reach the device
+    one at a time, at most once every min_interval seconds"""
+
+    def __init__(self, device, min_interval=0.1, dispatcher=None):
+        self.device = device
+        self.min_interval = min_interval
+        self.dispatcher = dispatcher or get_command_dispatcher()
+        self._pending = OrderedDict()  # kind -> (action, args, kwargs)
+        self._lock = Lock()
+        self._scheduled = False  # waiting in the dispatcher or in flight
+        self._last_sent = 0
+        self.merged = 0  # commands dropped because they were superseded
+
+    def __len__(self):
+        return len(self._pending)
+
+    def submit(self, action, *args, **kwargs):
+        """ queue a call of one of the device bus_actions
+
+        Raises:
+            ValueError: for any other device attribute
+        """
+        if action not in self.device.bus_actions:
+            raise ValueError(f"{action} is not a device action")
+        kind = COMMAND_KINDS.get(action) or object()  # unknown actions never merge
+        with self._lock:
+            if kind == "toggle" and "toggle" in self._pending:
+                # toggle + toggle == no-op
+                self._pending.pop("toggle")
+                self.merged += 2
+                return
+            if kind == "toggle" and "power" in self._pending:
+                # turn_on + toggle == turn_off
+                power, _, _ = self._pending.pop("power")
+                kind, action, args, kwargs = "power", _OPPOSITE_POWER[power], (), {}
+                self.merged += 1
+            elif kind == "power" and "toggle" in self._pending:
+                self._pending.pop("toggle")
+                self.merged += 1
+            if kind in self._pending:
+                self._pending.pop(kind)
+                self.merged += 1
+            self._pending[kind] = (action, args, kwargs)
+            if not self._scheduled:
+                self._scheduled = True
+                self.dispatcher.schedule(self, self._last_sent + self.min_interval)
+
+    def _send_next(self):
+        with self._lock:
+            if not self._pending:
+                self._scheduled = False
+                return
+            _, (action, args, kwargs) = self._pending.popitem(last=False)
+        start = time.monotonic()
+        try:
+            getattr(self.device, action)(*args, **kwargs)
+        except Exception:
+            LOG.exception(f"{self.device.device_id} failed to run {action}")
+            METRICS.incr(f"command.{self.device.__class__.__name__}.errors")
+        METRICS.observe(f"command.{self.device.__class__.__name__}.rtt",
+                        time.monotonic() - start)
+        with self._lock:
+            self._last_sent = time.monotonic()
+            if self._pending:
+                self.dispatcher.schedule(self, self._last_sent + self.min_interval)
+            else:
+                self._scheduled = False
+
+
+class CommandDispatcher(Thread):
+    """ sends queued commands when they are due, commands for different
+    devices run in parallel in a small worker pool"""
+
+    def __init__(self, max_workers=4):
+        super().__init__(daemon=True)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers,
+                                           thread_name_prefix="iot-commands")
+        self._queue = []  # (due, seq, DeviceCommandQueue)
+        self._seq = itertools.count()
+        self._cond = Condition()
+
+    def schedule(self, command_queue, due):
+        """ send the next command of command_queue at monotonic time due"""
+        with self._cond:
+            heapq.heappush(self._queue, (due, next(self._seq), command_queue))
+            self._cond.notify()
+
+    def run(self):
+        while True:
+            with self._cond:
+                while not self._queue or self._queue[0][0] > time.monotonic():
+                    timeout = self._queue[0][0] - time.monotonic() if self._queue else None
+                    self._cond.wait(timeout)
+                _, _, command_queue = heapq.heappop(self._queue)
+            self.executor.submit(command_queue._send_next)
+
+
+_DISPATCHER = None
+_DISPATCHER_LOCK = Lock()
+
+
+def get_command_dispatcher():
+    """ the CommandDispatcher shared by all devices, started on first use"""
+    global _DISPATCHER
+    with _DISPATCHER_LOCK:
+        if _DISPATCHER is None:
+            _DISPATCHER = CommandDispatcher()
+            _DISPATCHER.start()
+    return _DISPATCHER
@@ -0,0 +1,117 @@
+import heapq
+import itertools
+import time
+from threading import Thread, Condition, Lock
+
+from ovos_utils.log import LOG
+
+from ovos_PHAL_plugin_commonIOT.opm.ratelimit import reserve_step, nonblocking
+
+
+class LightEffect:
+    """ handle for an effect running in the EffectScheduler"""
+
+    def __init__(self, name, steps, device=None):
+        self.name = name
+        self.steps = steps
+        self.device = device  # the device the steps send commands to
+        self.cancelled = False
+        self.finished = False
+
+    @property
+    def running(self):
+        return not (self.cancelled or self.finished)
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class EffectScheduler(Thread):
+    """ runs the light effects of every device from a single thread
+
+    an effect is a generator, every next() performs one step (eg. a
+    brightness change) and yields the seconds to wait before the next
+    step. Steps of all effects are ordered in a priority queue by due time
+    and the total step rate is capped by max_rate"""
+
+    def __init__(self, max_rate=50):
+        super().__init__(daemon=True)
+        self.max_rate = max_rate  # steps per second, across all effects
+        self._queue = []  # (due, seq, LightEffect)
+        self._seq = itertools.count()
+        self._cond = Condition()
+        self._last_step = 0
+
+    def start_effect(self, name, steps, device=None):
+        """ schedule a generator of steps, returns a LightEffect handle,
+        steps of device wait for its host rate limit without blocking
+        the other effects"""
+        effect = LightEffect(name, steps, device)
+        self._push(time.monotonic(), effect)
+        return effect
+
+    def _push(self, due, effect):
+        with self._cond:
+            heapq.heappush(self._queue, (due, next(self._seq), effect))
+            self._cond.notify()
+
+    def _next_due(self):
+        with self._cond:
+            while True:
+                if not self._queue:
+                    self._cond.wait()
+                    continue
+                due, _, effect = self._queue[0]
+                if effect.cancelled:
+                    heapq.heappop(self._queue)
+                    continue
+                delay = due - time.monotonic()
+                if delay > 0:
+                    # a sooner effect may be pushed while waiting
+                    self._cond.wait(delay)
+                    continue
+                heapq.heappop(self._queue)
+                return effect
+
+    def run(self):
+        while True:
+            effect = self._next_due()
+            # global command rate cap
+            wait = self._last_step + 1 / self.max_rate - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            if effect.cancelled:
+                continue
+            if effect.device is not None:
+                busy = reserve_step(effect.device)
+                if busy:
+                    # host rate limited, retry the same step later
+                    self._push(time.monotonic() + busy, effect)
+                    continue
+            self._last_step = time.monotonic()
+            try:
+                with nonblocking(effect.device):
+                    delay = next(effect.steps)
+            except StopIteration:
+                effect.finished = True
+                continue
+            except Exception:
+                LOG.exception(f"light effect {effect.name} failed")
+                effect.finished = True
+                continue
+            if not effect.cancelled:
+                self._push(time.monotonic() + (delay or 0), effect)
+
+
+_SCHEDULER = None
+_SCHEDULER_LOCK = Lock()
+
+
+def get_effect_scheduler():
+    """ the EffectScheduler shared by all devices, started on first use"""
+    global _SCHEDULER
+    with _SCHEDULER_LOCK:
+        if _SCHEDULER is None:
+            _SCHEDULER = EffectScheduler()
+            _SCHEDULER.start()
+    return _SCHEDULER
@@ -1,44 +1,70 @@
 import itertools
 import random
-import time
-from threading import Thread
-from time import sleep
 
 from lingua_franca.util.colors import Color
+from ovos_utils.log import LOG
 
 from ovos_PHAL_plugin_commonIOT.opm.base import IOTCapabilties, Switch, IOTDeviceType, Plug
+from ovos_PHAL_plugin_commonIOT.opm.colors import WHITE, BLACK, COLOR_WHEEL, \
+    color_wheel_fades, resolve_color, resolve_rgb, color_from_rgb, color_from_hex, \
+    color_from_hsv
+from ovos_PHAL_plugin_commonIOT.opm.effects import get_effect_scheduler
+from ovos_PHAL_plugin_commonIOT.opm.transitions import ColorTransition
+
+
+def _brightness_update(value, percent=True, *args, **kwargs):
+    return {"brightness_255": round(value * 255 / 100) if percent else value}
+
+
+def _color_update(color="white", *args, **kwargs):
+    return {"color": resolve_color(color)}
+
+
+def _power_color_update(color="white", *args, **kwargs):
+    # a bulb without color support only turns on or off, see Bulb.change_color
+    is_on = resolve_rgb(color) != BLACK
+    return {"is_on": is_on, "color": None}
 
 
 class Bulb(Switch):
+    __slots__ = ()
     capabilities = Plug.capabilities + [
         IOTCapabilties.REPORT_BRIGHTNESS,
         IOTCapabilties.CHANGE_BRIGHTNESS,
         IOTCapabilties.BLINK_LIGHT,
         IOTCapabilties.BEACON_LIGHT
     ]
+    cached_states = Switch.cached_states + ("brightness_255", "color")
+    bus_actions = Switch.bus_actions + ("beacon", "beacon_slow", "blink",
+                                        "color_cycle", "random_color_cycle",
+                                        "cross_fade", "stop_effect")
+    state_updates = {
+        # the reported color depends on the power state
+        "turn_on": lambda *args, **kwargs: {"is_on": True, "color": None},
+        "turn_off": lambda *args, **kwargs: {"is_on": False, "color": None},
+        "change_brightness": _brightness_update,
+        "change_color": _power_color_update
+    }
 
     def __init__(self, device_id, host=None, name="generic_bulb",
                  area=None, device_type=IOTDeviceType.BULB, raw_data=None):
         super().__init__(device_id, host, name, area, device_type, raw_data)
 
     def change_color(self, color="white"):
-        if isinstance(color, Color):
-            if color.rgb255 == (0, 0, 0):
-                self.turn_off()
-            else:
-                if self.is_off:
-                    self.turn_on()
-                if Color.from_name("white") != color:
-                    print("ERROR: bulb does not support color change")
+        rgb = resolve_rgb(color)
+        if rgb == BLACK:
+            self.turn_off()
         else:
-            color = Color.from_name(color)
-            self.change_color(color)
+            if self.is_off:
+                self.turn_on()
+            if rgb != WHITE:
+                LOG.error(f"{self.device_id} does not support color change")
 
     @property
     def color(self):
         if self.is_off:
-            return Color.from_name("black")
-        return Color.from_name("white")
+            return color_from_rgb(*BLACK)
+        return color_from_rgb(*WHITE)
 
     @property
     def brightness(self):
@@ -64,19 +90,31 @@ class Bulb(Switch):
         self.change_brightness(100)
 
     def reset(self):
-        self.mode = ""
-        self._timer = None
+        self.stop_effect()
         if self.is_off:
             self.turn_on()
         self.set_high_brightness()
 
+    # effects
+    def start_effect(self, mode, steps):
+        """ run a generator of effect steps in the shared EffectScheduler,
+        any effect already running on this bulb is cancelled first"""
+        self.stop_effect()
+        self.mode = mode
+        self._timer = get_effect_scheduler().start_effect(mode, steps, self)
+
+    def stop_effect(self):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = None
+        self.mode = ""
+
     def beacon_slow(self, speed=0.9):
 
         assert 0 <= speed <= 1
 
         if self.is_off:
             self.turn_on()
-        self.mode = "beacon"
 
         def cycle():
             while self.mode == "beacon":
@@ -84,16 +122,14 @@ class Bulb(Switch):
                 while i < 100:
                     i += 5
                     self.change_brightness(i)
-                    sleep(1 - speed)
+                    yield 1 - speed
 
                 while i > 5:
                     i -= 5
                     self.change_brightness(i)
-                    sleep(1 - speed)
+                    yield 1 - speed
 
-        self._timer = Thread(target=cycle)
-        self._timer.setDaemon(True)
-        self._timer.start()
+        self.start_effect("beacon", cycle())
 
     def beacon(self, speed=0.7):
 
@@ -101,47 +137,47 @@ class Bulb(Switch):
 
         if self.is_off:
             self.turn_on()
-        self.mode = "beacon"
 
         def cycle():
             while self.mode == "beacon":
                 self.change_brightness(100)
-                sleep(1 - speed)
+                yield 1 - speed
                 self.change_brightness(50)
-                sleep(1 - speed)
+                yield 1 - speed
                 self.change_brightness(1)
-                sleep(1 - speed)
+                yield 1 - speed
                 self.change_brightness(50)
 
-        self._timer = Thread(target=cycle)
-        self._timer.setDaemon(True)
-        self._timer.start()
+        self.start_effect("beacon", cycle())
 
     def blink(self, speed=0):
 
         assert 0 <= speed <= 1
 
-        self.mode = "blink"
         if self.is_off:
             self.turn_on()
 
         def cycle():
             while self.mode == "blink":
                 self.turn_off()
-                sleep(1 - speed)
+                yield 1 - speed
                 self.turn_on()
-                sleep(1 - speed)
+                yield 1 - speed
 
-        self._timer = Thread(target=cycle)
-        self._timer.setDaemon(True)
-        self._timer.start()
+        self.start_effect("blink", cycle())
 
 
 class RGBBulb(Bulb):
+    __slots__ = ()
     capabilities = Bulb.capabilities + [
         IOTCapabilties.REPORT_COLOR,
         IOTCapabilties.CHANGE_COLOR
     ]
+    state_updates = dict(Bulb.state_updates,
+                         change_color=_color_update,
+                         change_color_rgb=lambda r, g, b: {"color": color_from_rgb(r, g, b)},
+                         change_color_hex=lambda hexcolor: {"color": color_from_hex(hexcolor)},
+                         change_color_hsv=lambda h, s, v: {"color": color_from_hsv(h, s, v)})
 
     def __init__(self, device_id, host=None, name="generic_rgb_bulb",
                  area=None, device_type=IOTDeviceType.RGB_BULB, raw_data=None):
@@ -151,126 +187,82 @@ class RGBBulb(Bulb):
         super().reset()
         self.change_color("white")
 
-    @property
-    def as_dict(self):
+    def _dict_state(self):
+        return self.is_on, self.brightness_255
+
+    def _build_dict(self, state):
+        is_on, brightness = state
         return {
             "host": self.host,
             "name": self.name,
             "device_type": "rgb bulb",
-            "brightness": self.brightness_255,
-            "state": self.is_on,
+            "brightness": brightness,
+            "state": is_on,
             "raw": self.raw_data
         }
 
     # color operations
     def change_color_hex(self, hexcolor):
-        self.change_color(Color.from_hex(hexcolor))
+        self.change_color(color_from_hex(hexcolor))
 
     def change_color_hsv(self, h, s, v):
-        self.change_color(Color.from_hsv(h, s, v))
+        self.change_color(color_from_hsv(h, s, v))
 
     def change_color_rgb(self, r, g, b):
-        self.change_color(Color.from_rgb(r, g, b))
-
-    def cross_fade(self, color1, color2, steps=100):
-        if isinstance(color1, Color):
-            color1 = color1.rgb255
-        if isinstance(color2, Color):
-            color2 = color2.rgb255
-        r1, g1, b1 = color1
-        r2, g2, b2 = color2
-        for i in range(1, steps + 1):
-            r = r1 - int(i * float(r1 - r2) // steps)
-            g = g1 - int(i * float(g1 - g2) // steps)
-            b = b1 - int(i * float(b1 - b2) // steps)
+        self.change_color(color_from_rgb(r, g, b))
+
+    def cross_fade(self, color1, color2, steps=None, duration=1.0, fps=20,
+                   curve="linear"):
+        """
+        Fade from color1 to color2 over duration seconds,
+        frames the bulb can not keep up with are dropped
+
+        curve can be "linear", "hsv" or "perceptual",
+        steps overrides the number of frames computed from fps
+        """
+        transition = ColorTransition(resolve_rgb(color1), resolve_rgb(color2),
+                                     duration=duration,
+                                     fps=fps, curve=curve, frames=steps)
+        self.play_transition(transition)
 
+    def play_transition(self, transition):
+        for r, g, b in transition.timed_frames():
             self.change_color_rgb(r, g, b)
 
-    def color_cycle(self, color_time=2, cross_fade=False):
-        self.mode = "color_cycle"
-        # print("Light mode: {mode}".format(mode=self.mode))
+    def color_cycle(self, color_time=2, cross_fade=False, fade_duration=1.0,
+                    fps=20, curve="linear"):
         if self.is_off:
             self.turn_on()
 
         def cycle_color():
+            colorwheel = COLOR_WHEEL
 
-            class Red(Color):
-                def __new__(cls, *args, **kwargs):
-                    return Color.from_rgb(255, 0, 0)
-
-            class Orange(Color):
-                def __new__(cls, *args, **kwargs):
-                    return Color.from_rgb(255, 125, 0)
-
-            class Yellow(Color):
-                def __new__(cls, *args, **kwargs):
-                    return Color.from_rgb(255, 255, 0)
-
-            class SpringGreen(Color):
-                def __new__(cls, *args, **kwargs):
-                    return Color.from_rgb(125, 255, 0)
-
-            class Green(Color):
-                def __new__(cls, *args, **kwargs):
-                    return Color.from_rgb(0, 255, 0)
-
-            class Turquoise(Color):
-                def __new__(cls, *args, **kwargs):
-                    return Color.from_rgb(0, 255, 125)
-
-            class Cyan(Color):
-                def __new__(cls, *args, **kwargs):
-                    return Color.from_rgb(0, 255, 255)
-
-            class Ocean(Color):
-                def __new__(cls, *args, **kwargs):
-                    return Color.from_rgb(0, 125, 255)
-
-            class Blue(Color):
-                def __new__(cls, *args, **kwargs):
-                    return Color.from_rgb(0, 0, 255)
-
-            class Violet(Color):
-                def __new__(cls, *args, **kwargs):
-                    return Color.from_rgb(125, 0, 255)
-
-            class Magenta(Color):
-                def __new__(cls, *args, **kwargs):
-                    return Color.from_rgb(255, 0, 255)
-
-            class Raspberry(Color):
-                def __new__(cls, *args, **kwargs):
-                    return Color.from_rgb(255, 0, 125)
-
-            colorwheel = [Red(), Orange(), Yellow(), SpringGreen(),
-                          Green(), Turquoise(), Cyan(), Ocean(),
-                          Blue(), Violet(), Magenta(), Raspberry()]
+            # every fade of the wheel is precomputed once
+            fades = []
+            if cross_fade:
+                fades = color_wheel_fades(fade_duration, fps, curve)
 
             # use cycle() to treat the list in a circular fashion
-            colorpool = itertools.cycle(colorwheel)
+            colorpool = itertools.cycle(range(len(colorwheel)))
 
             # get the first color before the loop
-            color = next(colorpool)
+            idx = next(colorpool)
 
             while self.mode == "color_cycle":
                 # set to color and wait
-                self.change_color(color)
-                time.sleep(color_time)
+                self.change_color(color_from_rgb(*colorwheel[idx]))
+                yield color_time
 
                 # fade from color to next color
-                next_color = next(colorpool)
                 if cross_fade:
-                    self.cross_fade(color, next_color)
+                    yield from fades[idx].play_steps(self.change_color_rgb)
 
                 # ready for next loop
-                color = next_color
+                idx = next(colorpool)
 
-        self._timer = Thread(target=cycle_color)
-        self._timer.setDaemon(True)
-        self._timer.start()
+        self.start_effect("color_cycle", cycle_color())
 
     def random_color_cycle(self, color_time=2):
-        self.mode = "random_color_cycle"
         if self.is_off:
             self.turn_on()
 
@@ -279,11 +271,9 @@ class RGBBulb(Bulb):
             while self.mode == "random_color_cycle":
                 # set to color and wait
                 self.random_color()
-                time.sleep(color_time)
+                yield color_time
 
-        self._timer = Thread(target=cycle_color)
-        self._timer.setDaemon(True)
-        self._timer.start()
+        self.start_effect("random_color_cycle", cycle_color())
 
     def random_color(self):
         color = Color.from_rgb(random.randint(0, 255), random.randint(0, 255), random.randint(0, 255))
@@ -291,6 +281,8 @@ class RGBBulb(Bulb):
 
 
 class RGBWBulb(RGBBulb):
+    __slots__ = ()
+
     def __init__(self, device_id, host=None, name="generic_rgbw_bulb",
                  area=None, device_type=IOTDeviceType.RGBW_BULB, raw_data=None):
         super().__init__(device_id, host, name, area, device_type, raw_data)
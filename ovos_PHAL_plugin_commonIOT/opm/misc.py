@@ -2,6 +2,8 @@ from ovos_PHAL_plugin_commonIOT.opm.base import IOTCapabilties, IOTDeviceType, S
 
 
 class Heater(Plug):
+    __slots__ = ()
+
     def __init__(self, device_id, host=None, name="generic_heater",
                  area=None, device_type=IOTDeviceType.HEATER, raw_data=None):
         super().__init__(device_id, host, name, area, device_type, raw_data)
@@ -11,6 +13,8 @@ class Heater(Plug):
 
 
 class AirConditioner(Plug):
+    __slots__ = ()
+
     def __init__(self, device_id, host=None, name="generic_ac",
                  area=None, device_type=IOTDeviceType.AC, raw_data=None):
         super().__init__(device_id, host, name, area, device_type, raw_data)
@@ -20,18 +24,24 @@ class AirConditioner(Plug):
 
 
 class Vent(Plug):
+    __slots__ = ()
+
     def __init__(self, device_id, host=None, name="generic_vent",
                  area=None, device_type=IOTDeviceType.VENT, raw_data=None):
         super().__init__(device_id, host, name, area, device_type, raw_data)
 
 
 class Humidifier(Plug):
+    __slots__ = ()
+
     def __init__(self, device_id, host=None, name="generic_humidifier",
                  area=None, device_type=IOTDeviceType.HUMIDIFIER, raw_data=None):
         super().__init__(device_id, host, name, area, device_type, raw_data)
 
 
 class Vacuum(Plug):
+    __slots__ = ()
+
     def __init__(self, device_id, host=None, name="generic_vacuum",
                  area=None, device_type=IOTDeviceType.VACUUM, raw_data=None):
         super().__init__(device_id, host, name, area, device_type, raw_data)
@@ -41,6 +51,7 @@ class Vacuum(Plug):
 
 
 class Camera(Sensor):
+    __slots__ = ()
     capabilities = Sensor.capabilities + [
         IOTCapabilties.GET_PICTURE
     ]
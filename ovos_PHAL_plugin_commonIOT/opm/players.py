@@ -2,6 +2,7 @@ from ovos_PHAL_plugin_commonIOT.opm.base import IOTCapabilties, IOTDeviceType, P
 
 
 class MediaPlayer(Plug):
+    __slots__ = ()
     capabilities = Plug.capabilities + [
         IOTCapabilties.PAUSE_PLAYBACK,
         IOTCapabilties.RESUME_PLAYBACK,
@@ -31,6 +32,8 @@ class MediaPlayer(Plug):
 
 
 class Radio(MediaPlayer):
+    __slots__ = ()
+
     def __init__(self, device_id, host=None, name="generic_radio",
                  area=None, device_type=IOTDeviceType.RADIO, raw_data=None):
         super().__init__(device_id, host, name, area, device_type, raw_data)
@@ -53,6 +56,8 @@ class Radio(MediaPlayer):
 
 
 class TV(MediaPlayer):
+    __slots__ = ()
+
     def __init__(self, device_id, host=None, name="generic_tv",
                  area=None, device_type=IOTDeviceType.TV, raw_data=None):
         super().__init__(device_id, host, name, area, device_type, raw_data)
@@ -0,0 +1,219 @@
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from threading import Lock
+
+from ovos_PHAL_plugin_commonIOT.metrics import METRICS
+
+
+class RateLimitExceeded(RuntimeError):
+    """ a device command would have waited longer than max_wait for its host"""
+
+
+class TokenBucket:
+    """ rate tokens per second, up to burst tokens saved while idle"""
+    __slots__ = ("rate", "burst", "tokens", "updated", "lock")
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = Lock()
+
+    def reserve(self, max_wait):
+        """ take a token, tokens may be borrowed from the future
+
+        Returns:
+            float: seconds to wait before using the token,
+                   None if that would be longer than max_wait
+        """
+        with self.lock:
+            self._refill()
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0
+            wait = -self.tokens / self.rate
+            if wait > max_wait:
+                self.tokens += 1  # rejected, give the token back
+                return None
+            return wait
+
+    def try_take(self):
+        """ take a token only if one is available now
+
+        Returns:
+            float: 0 if a token was taken, else seconds until one is available
+        """
+        with self.lock:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+class HostRateLimiter:
+    """ one token bucket per host, shared by every device on that host,
+    so a bulb reported by two plugins or a hub with many children is
+    limited as a whole
+
+    config (see configure):
+        rate (float): commands per second, 0 disables rate limiting
+        burst (int): commands allowed at once after being idle
+        max_wait (float): seconds a command may wait before it is rejected
+        classes (dict): device class name -> {"rate", "burst"}, subclasses
+            inherit the limits of their parents
+        hosts (dict): host -> {"rate", "burst"}, wins over classes
+
+    the limits of a host are taken from the first device sending to it"""
+
+    def __init__(self, config=None):
+        self._buckets = {}
+        self._lock = Lock()
+        self.configure(config or {})
+
+    def configure(self, config):
+        with self._lock:
+            self.rate = config.get("rate", 20)
+            self.burst = config.get("burst", 20)
+            self.max_wait = config.get("max_wait", 1.0)
+            self.classes = config.get("classes", {})
+            self.hosts = config.get("hosts", {})
+            self._buckets = {}
+
+    @property
+    def enabled(self):
+        return self.rate > 0 or bool(self.hosts) or bool(self.classes)
+
+    def _limits(self, device, host):
+        limits = self.hosts.get(host)
+        if limits is None:
+            limits = next((self.classes[c.__name__] for c in type(device).__mro__
+                           if c.__name__ in self.classes), {})
+        return limits.get("rate", self.rate), limits.get("burst", self.burst)
+
+    def _bucket(self, device, host):
+        bucket = self._buckets.get(host)
+        if bucket is None:
+            with self._lock:
+                bucket = self._buckets.get(host)
+                if bucket is None:
+                    rate, burst = self._limits(device, host)
+                    bucket = None
+                    if rate > 0:
+                        bucket = TokenBucket(rate, max(1, burst))
+                    self._buckets[host] = bucket
+        return bucket
+
+    def acquire(self, device, host):
+        """ block until device may send a command to host
+
+        Raises:
+            RateLimitExceeded: if that would take longer than max_wait
+        """
+        bucket = self._bucket(device, host)
+        if bucket is None:
+            return
+        wait = bucket.reserve(self.max_wait)
+        if wait is None:
+            METRICS.incr(f"command.{device.__class__.__name__}.rate_rejected")
+            raise RateLimitExceeded(f"{host} is receiving too many commands")
+        if wait:
+            METRICS.incr(f"command.{device.__class__.__name__}.rate_waits")
+            METRICS.observe(f"command.{device.__class__.__name__}.rate_wait", wait)
+            time.sleep(wait)
+
+    def try_acquire(self, device, host):
+        """ take a token for host without waiting
+
+        Returns:
+            float: 0 if a token was taken, else seconds until one is available
+        """
+        bucket = self._bucket(device, host)
+        if bucket is None:
+            return 0
+        return bucket.try_take()
+
+
+_LIMITER = HostRateLimiter()
+# hosts the current thread is already sending to, commands implemented
+# with other commands (change_color_rgb -> change_color) use one token
+_active = threading.local()
+
+
+def get_rate_limiter():
+    """ the HostRateLimiter shared by all devices"""
+    return _LIMITER
+
+
+def _held_hosts():
+    hosts = getattr(_active, "hosts", None)
+    if hosts is None:
+        hosts = _active.hosts = set()
+    return hosts
+
+
+def reserve_step(device):
+    """ non blocking token for the next effect step of device
+
+    Returns:
+        float: 0 if the step may run now, see nonblocking, else seconds
+               until the host accepts commands again
+    """
+    if not _LIMITER.enabled:
+        return 0
+    wait = _LIMITER.try_acquire(device, device.host or device.device_id)
+    if wait:
+        METRICS.incr(f"command.{device.__class__.__name__}.rate_deferred")
+    return wait
+
+
+@contextmanager
+def nonblocking(device=None):
+    """ device actions in this block never wait for the rate limiter,
+    used by the effect scheduler thread, which runs the effects of every
+    device. Commands for device use the token taken by reserve_step,
+    commands for any other busy host are dropped"""
+    hosts = _held_hosts()
+    host = device.host or device.device_id if device is not None else None
+    held = host is not None and host not in hosts
+    if held:
+        hosts.add(host)
+    _active.nonblocking = True
+    try:
+        yield
+    finally:
+        _active.nonblocking = False
+        if held:
+            hosts.discard(host)
+
+
+def rate_limited(action):
+    # device action that waits for a token of the device host first
+    @functools.wraps(action)
+    def wrapper(self, *args, **kwargs):
+        host = self.host or self.device_id
+        hosts = _held_hosts()
+        if host in hosts or not _LIMITER.enabled:
+            return action(self, *args, **kwargs)
+        if getattr(_active, "nonblocking", False):
+            if _LIMITER.try_acquire(self, host):
+                METRICS.incr(f"command.{self.__class__.__name__}.rate_dropped")
+                return None
+        else:
+            _LIMITER.acquire(self, host)
+        hosts.add(host)
+        try:
+            return action(self, *args, **kwargs)
+        finally:
+            hosts.discard(host)
+
+    wrapper.rate_limited = True
+    return wrapper
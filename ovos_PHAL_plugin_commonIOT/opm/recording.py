@@ -0,0 +1,61 @@
+import json
+from threading import Lock
+
+from ovos_utils.log import LOG
+
+
+class ScanRecorder:
+    """ appends scanner output to a NDJSON file, one line per scan, delta
+    scan or batch of pushed events, devices are stored as_record
+
+        {"t": 1700000000.0, "scanner": "lan", "scan": [record, ...]}
+        {"t": 1700000003.0, "scanner": "lan", "delta": [["added", record], ...]}
+
+    see ovos_PHAL_plugin_commonIOT.replay to feed a recording back"""
+
+    def __init__(self, path, scanner=""):
+        self.path = path
+        self.scanner = scanner
+        self._file = None
+        self._lock = Lock()
+        self.failed = False
+
+    def record(self, kind, timestamp, entries):
+        """ kind is "scan" for a list of devices, "delta" or "push"
+        for a list of (IOTScanEvent, device) tuples"""
+        if self.failed:
+            return
+        try:
+            if kind == "scan":
+                data = [dev.as_record() for dev in entries]
+            else:
+                data = [[event, dev.as_record()] for event, dev in entries]
+            line = json.dumps({"t": timestamp, "scanner": self.scanner, kind: data},
+                              separators=(",", ":"), default=str)
+            with self._lock:
+                if self._file is None:
+                    self._file = open(self.path, "a")
+                self._file.write(line + "\n")
+                self._file.flush()
+        except Exception as e:
+            # never break discovery because of the recording
+            LOG.error(f"stopped recording {self.scanner} to {self.path}: {e}")
+            self.failed = True
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def read_recording(path, scanner=None):
+    """ recorded entries in file order, optionally only those of scanner"""
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            if scanner is None or entry.get("scanner") == scanner:
+                yield entry
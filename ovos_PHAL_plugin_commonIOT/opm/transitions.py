@@ -0,0 +1,151 @@
+import colorsys
+import time
+
+# sRGB <-> CIE XYZ (D65)
+_RGB_TO_XYZ = ((0.4124, 0.3576, 0.1805),
+               (0.2126, 0.7152, 0.0722),
+               (0.0193, 0.1192, 0.9505))
+_XYZ_TO_RGB = ((3.2406, -1.5372, -0.4986),
+               (-0.9689, 1.8758, 0.0415),
+               (0.0557, -0.2040, 1.0570))
+_WHITE = (0.95047, 1.0, 1.08883)
+
+
+def _clamp255(value):
+    return max(0, min(255, int(round(value))))
+
+
+def _to_linear(c):
+    c = c / 255
+    return c / 12.92 if c <= 0.04045 else ((c + 0.055) / 1.055) ** 2.4
+
+
+def _from_linear(c):
+    c = max(0.0, min(1.0, c))
+    c = 12.92 * c if c <= 0.0031308 else 1.055 * c ** (1 / 2.4) - 0.055
+    return _clamp255(c * 255)
+
+
+def _lab_f(t):
+    return t ** (1 / 3) if t > 0.008856 else 7.787 * t + 16 / 116
+
+
+def _lab_f_inv(t):
+    return t ** 3 if t ** 3 > 0.008856 else (t - 16 / 116) / 7.787
+
+
+def rgb_to_lab(rgb):
+    lin = [_to_linear(c) for c in rgb]
+    fx, fy, fz = (_lab_f(sum(m * c for m, c in zip(row, lin)) / w)
+                  for row, w in zip(_RGB_TO_XYZ, _WHITE))
+    return 116 * fy - 16, 500 * (fx - fy), 200 * (fy - fz)
+
+
+def lab_to_rgb(lab):
+    l, a, b = lab
+    fy = (l + 16) / 116
+    xyz = [w * _lab_f_inv(f)
+           for w, f in zip(_WHITE, (fy + a / 500, fy, fy - b / 200))]
+    return tuple(_from_linear(sum(m * c for m, c in zip(row, xyz)))
+                 for row in _XYZ_TO_RGB)
+
+
+def _steps(n):
+    # frame i is at i/n, the start color is not repeated and
+    # the last frame is always the target color
+    return [i / n for i in range(1, n + 1)]
+
+
+def _linear_frames(start, end, n):
+    deltas = [e - s for s, e in zip(start, end)]
+    return [tuple(_clamp255(s + d * t) for s, d in zip(start, deltas))
+            for t in _steps(n)]
+
+
+def _hsv_frames(start, end, n):
+    h1, s1, v1 = colorsys.rgb_to_hsv(*(c / 255 for c in start))
+    h2, s2, v2 = colorsys.rgb_to_hsv(*(c / 255 for c in end))
+    # go around the hue circle the short way
+    dh = (h2 - h1 + 0.5) % 1.0 - 0.5
+    return [tuple(_clamp255(c * 255) for c in
+                  colorsys.hsv_to_rgb((h1 + dh * t) % 1.0,
+                                      s1 + (s2 - s1) * t,
+                                      v1 + (v2 - v1) * t))
+            for t in _steps(n)]
+
+
+def _perceptual_frames(start, end, n):
+    lab1, lab2 = rgb_to_lab(start), rgb_to_lab(end)
+    deltas = [e - s for s, e in zip(lab1, lab2)]
+    frames = [lab_to_rgb([s + d * t for s, d in zip(lab1, deltas)])
+              for t in _steps(n)]
+    frames[-1] = tuple(end)  # avoid rounding drift on the final frame
+    return frames
+
+
+class ColorTransition:
+    """ precomputed fade between two rgb255 colors
+
+    all frames are computed once when the transition is created,
+    playback only looks them up by elapsed time"""
+    CURVES = {
+        "linear": _linear_frames,
+        "hsv": _hsv_frames,
+        "perceptual": _perceptual_frames
+    }
+
+    def __init__(self, start, end, duration=1.0, fps=20, curve="linear",
+                 frames=None):
+        """
+            Args:
+                start (tuple): initial (r, g, b) 0-255
+                end (tuple): final (r, g, b) 0-255
+                duration (float): seconds the whole transition should take
+                fps (float): frames per second, ignored if frames is set
+                curve (str): one of ColorTransition.CURVES
+                frames (int): explicit number of frames
+        """
+        if curve not in self.CURVES:
+            raise ValueError(f"unknown transition curve: {curve}")
+        n = frames or max(1, int(duration * fps))
+        self.duration = duration
+        self.frame_interval = duration / n
+        self.frames = self.CURVES[curve](tuple(start), tuple(end), n)
+
+    def frame_index(self, elapsed):
+        """ index of the frame that should be showing after elapsed seconds"""
+        if self.frame_interval <= 0:
+            return len(self.frames) - 1
+        return min(len(self.frames) - 1, int(elapsed / self.frame_interval))
+
+    def timed_frames(self):
+        """ yield frames on schedule, blocking between them
+
+        if the consumer falls behind (eg. a slow bulb) late frames are
+        dropped and playback jumps to the frame that is currently due"""
+        start = time.monotonic()
+        i = 0
+        while i < len(self.frames):
+            delay = start + i * self.frame_interval - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            i = max(i, self.frame_index(time.monotonic() - start))
+            yield self.frames[i]
+            i += 1
+
+    def play_steps(self, send):
+        """ non blocking playback for the effect scheduler
+
+        calls send(r, g, b) for the frame currently due and yields the
+        seconds to wait before the next one, late frames are dropped"""
+        start = time.monotonic()
+        i = 0
+        while i < len(self.frames):
+            i = max(i, self.frame_index(time.monotonic() - start))
+            send(*self.frames[i])
+            i += 1
+            if i < len(self.frames):
+                yield max(0.0, start + i * self.frame_interval - time.monotonic())
+
+    def __len__(self):
+        return len(self.frames)
@@ -0,0 +1,123 @@
+import json
+import os
+import time
+from importlib import import_module
+from threading import Lock, Timer
+
+from ovos_config.locations import get_xdg_data_save_path
+from ovos_utils.log import LOG
+
+from ovos_PHAL_plugin_commonIOT.opm.base import IOTDeviceType, Sensor, Switch, Plug
+from ovos_PHAL_plugin_commonIOT.opm.lights import Bulb, RGBBulb, RGBWBulb
+from ovos_PHAL_plugin_commonIOT.opm.misc import Heater, AirConditioner, Vent, \
+    Humidifier, Vacuum, Camera
+from ovos_PHAL_plugin_commonIOT.opm.players import MediaPlayer, Radio, TV
+
+# used when the plugin class of a stored device can not be imported
+GENERIC_DEVICES = {
+    IOTDeviceType.SENSOR: Sensor,
+    IOTDeviceType.PLUG: Plug,
+    IOTDeviceType.SWITCH: Switch,
+    IOTDeviceType.BULB: Bulb,
+    IOTDeviceType.RGB_BULB: RGBBulb,
+    IOTDeviceType.RGBW_BULB: RGBWBulb,
+    IOTDeviceType.TV: TV,
+    IOTDeviceType.RADIO: Radio,
+    IOTDeviceType.HEATER: Heater,
+    IOTDeviceType.AC: AirConditioner,
+    IOTDeviceType.VENT: Vent,
+    IOTDeviceType.HUMIDIFIER: Humidifier,
+    IOTDeviceType.CAMERA: Camera,
+    IOTDeviceType.MEDIA_PLAYER: MediaPlayer,
+    IOTDeviceType.VACUUM: Vacuum
+}
+
+
+def device_from_record(record):
+    """ rebuild a provisional device from IOTAbstractDevice.as_record output"""
+    try:
+        clazz = getattr(import_module(record["module"]), record["class"])
+        return clazz.from_record(record)
+    except Exception as e:
+        LOG.debug(f"using generic device for {record['device_id']}: {e}")
+    try:
+        clazz = GENERIC_DEVICES[IOTDeviceType(record.get("device_type"))]
+    except ValueError:  # custom device_type
+        clazz = Sensor
+    return clazz.from_record(record)
+
+
+class DeviceRegistryStore:
+    """ on disk snapshot of known devices, used for warm starts
+
+    saves are batched, many registry changes within save_delay seconds
+    result in a single write, and the file is replaced atomically
+
+    records may carry a "saved" timestamp, the time their device was last
+    known to be present, which counts as last_seen for max_age"""
+
+    def __init__(self, path=None, save_delay=5):
+        self.path = path or os.path.join(get_xdg_data_save_path(),
+                                         "iot_devices.json")
+        self.save_delay = save_delay
+        self._timer = None
+        self._lock = Lock()
+
+    def load(self, max_age=None):
+        """ stored device records, records last seen more than max_age
+        seconds ago are skipped"""
+        if not os.path.isfile(self.path):
+            return []
+        try:
+            with open(self.path) as f:
+                records = json.load(f)
+        except Exception as e:
+            LOG.error(f"failed to load device registry {self.path}: {e}")
+            return []
+        if max_age:
+            oldest = time.time() - max_age
+            records = [r for r in records
+                       if max(r.get("last_seen") or 0, r.get("saved") or 0) >= oldest]
+        return records
+
+    def schedule_save(self, get_records):
+        """ save get_records() after save_delay, unless a save is already pending"""
+        with self._lock:
+            if self._timer is not None:
+                return
+            self._timer = Timer(self.save_delay, self._save_pending, (get_records,))
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _save_pending(self, get_records):
+        with self._lock:
+            self._timer = None
+        self.save(get_records())
+
+    def cancel(self):
+        """ drop the pending save, if any
+
+        Returns:
+            bool: True if a save was pending
+        """
+        with self._lock:
+            timer, self._timer = self._timer, None
+        if timer is None:
+            return False
+        timer.cancel()
+        return True
+
+    def flush(self, get_records):
+        """ save get_records() now, replacing any pending save"""
+        self.cancel()
+        self.save(get_records())
+
+    def save(self, records):
+        tmp = self.path + ".tmp"
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(tmp, "w") as f:
+                json.dump(records, f, separators=(",", ":"), default=str)
+            os.replace(tmp, self.path)
+        except Exception as e:
+            LOG.error(f"failed to save device registry {self.path}: {e}")
@@ -0,0 +1,105 @@
+import time
+
+from ovos_PHAL_plugin_commonIOT.opm.base import IOTScannerPlugin, IOTScanEvent
+from ovos_PHAL_plugin_commonIOT.opm.recording import read_recording
+from ovos_PHAL_plugin_commonIOT.registry import device_from_record
+
+
+def _device(record):
+    device = device_from_record(record)
+    device._provisional = False  # a recorded sighting, not a restored placeholder
+    return device
+
+
+class ReplayScanner(IOTScannerPlugin):
+    """ feeds a recording made with config["record_path"] back through
+    the usual scan handling, for offline load tests and bug reports
+
+    config:
+        replay_path (str): the recording
+        replay_scanner (str): only replay entries of this scanner
+        replay_speed (float): 1.0 for real time, 2.0 twice as fast,
+            0 as fast as possible
+        replay_expire (bool): report every device lost after the last entry
+
+    timestamps follow the recording, so ttl based loss detection happens
+    at the same points of the recording regardless of replay speed"""
+
+    def __init__(self, bus=None, name="", config=None,
+                 new_device_callback=None, lost_device_callback=None,
+                 aliases=None):
+        super().__init__(bus, name, config, new_device_callback,
+                         lost_device_callback, aliases)
+        self.replay_path = self.config.get("replay_path")
+        self.replay_scanner = self.config.get("replay_scanner")
+        self.speed = self.config.get("replay_speed", 1.0)
+        self.expire_at_end = self.config.get("replay_expire", False)
+        self.recorder = None  # never record a replay into itself
+        self._now = None
+
+    def _recorded_time(self):
+        return self._now
+
+    def replay(self, path=None, speed=None):
+        """ replay the recording in this thread, blocks until done
+
+        Returns:
+            dict: number of entries and devices replayed, wall clock seconds
+        """
+        speed = self.speed if speed is None else speed
+        self.clock = self._recorded_time
+        entries = devices = 0
+        start = time.monotonic()
+        first = None
+        for entry in read_recording(path or self.replay_path, self.replay_scanner):
+            t = entry["t"]
+            if first is None:
+                first = t
+            if speed > 0:
+                self._wait_until(first, start, t, speed)
+            # devices due to expire before this entry are lost first
+            self._expire_until(t)
+            self._now = t
+            if "scan" in entry:
+                batch = [_device(r) for r in entry["scan"]]
+                self.handle_scan_results(batch)
+            else:
+                batch = [(IOTScanEvent(e), _device(r))
+                         for e, r in entry.get("delta") or entry.get("push", [])]
+                if "delta" in entry:
+                    self.handle_scan_delta(batch)
+                else:
+                    self.handle_pushed_events(batch)
+            entries += 1
+            devices += len(batch)
+        if self.expire_at_end and self._now is not None:
+            self._expire_until(self._now + self.ttl)
+            for device_id in list(self.timestamps):
+                self._device_lost(device_id)  # delta devices never expire
+        return {"entries": entries, "devices": devices,
+                "seconds": time.monotonic() - start}
+
+    def _expire_until(self, t):
+        # step the clock through every expiry up to t, so devices are
+        # lost at their recorded time even when replaying at full speed
+        while self.next_expiry is not None and self.next_expiry <= t:
+            self._now = max(self._now or 0, self.next_expiry)
+            self.check_lost_devices()
+
+    def _wait_until(self, first, start, t, speed):
+        # check ttl expiry while waiting, as a live scanner would
+        due = start + (t - first) / speed
+        while True:
+            remaining = due - time.monotonic()
+            if remaining <= 0:
+                return
+            if self.next_expiry is not None and self.next_expiry < t:
+                expiry_due = start + (self.next_expiry - first) / speed
+                if expiry_due <= time.monotonic():
+                    self._expire_until(self.next_expiry)
+                    continue
+                remaining = min(remaining, expiry_due - time.monotonic())
+            time.sleep(max(0.0, remaining))
+
+    def run(self):
+        self.replay()
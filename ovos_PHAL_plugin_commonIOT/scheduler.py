@@ -0,0 +1,140 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread
+
+from ovos_utils.log import LOG
+
+from ovos_PHAL_plugin_commonIOT.opm.base import IOTAsyncScannerPlugin
+
+
+class IOTScanScheduler(Thread):
+    """ runs every IOTScannerPlugin from a single asyncio event loop
+
+    async scanners are awaited directly, legacy blocking scanners run in a
+    bounded thread pool so a slow scan never blocks the other scanners"""
+
+    def __init__(self, max_workers=4):
+        super().__init__(daemon=True)
+        self.loop = asyncio.new_event_loop()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers,
+                                           thread_name_prefix="iot-scan")
+        self._tasks = {}
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def add_scanner(self, name, scanner):
+        """ schedule a scanner, safe to call from any thread"""
+        self.loop.call_soon_threadsafe(self._schedule, name, scanner)
+
+    def remove_scanner(self, name):
+        """ stop scheduling a scanner, safe to call from any thread"""
+        self.loop.call_soon_threadsafe(self._unschedule, name)
+
+    def shutdown(self, timeout=5):
+        """ cancel every scanner task, wait up to timeout seconds for them
+        to finish and stop the event loop, safe to call from any thread"""
+        if self.is_alive():
+            future = asyncio.run_coroutine_threadsafe(self._cancel_all(), self.loop)
+            try:
+                future.result(timeout)
+            except Exception as e:
+                LOG.warning(f"scanner tasks did not stop cleanly: {e}")
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.join(timeout)
+        if not self.is_alive() and not self.loop.is_closed():
+            self.loop.close()
+        self.executor.shutdown(wait=False)
+
+    async def _cancel_all(self):
+        tasks = [task for name in list(self._tasks)
+                 for task in self._tasks.pop(name)]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _schedule(self, name, scanner):
+        self._unschedule(name)
+        self._tasks[name] = (
+            self.loop.create_task(self._scan_loop(name, scanner)),
+            self.loop.create_task(self._expiry_loop(name, scanner))
+        )
+
+    def _unschedule(self, name):
+        for task in self._tasks.pop(name, ()):
+            task.cancel()
+
+    async def _scan(self, scanner):
+        if isinstance(scanner, IOTAsyncScannerPlugin):
+            return await scanner.ascan()
+        # scan() is usually a generator, consume it inside the worker
+        # so no blocking network calls happen in the event loop
+        if scanner.supports_delta:
+            return await self.loop.run_in_executor(
+                self.executor, lambda: list(scanner.scan_delta()))
+        return await self.loop.run_in_executor(
+            self.executor, lambda: list(scanner.scan()))
+
+    async def _scan_loop(self, name, scanner):
+        wake = asyncio.Event()
+        scanner.wakeup_callback = lambda: self.loop.call_soon_threadsafe(wake.set)
+        if scanner.supports_delta and not isinstance(scanner, IOTAsyncScannerPlugin):
+            handle_results = scanner.handle_scan_delta
+        else:
+            handle_results = scanner.handle_scan_results
+        while True:
+            if scanner.supports_scan:
+                await self._scan_once(name, scanner, handle_results)
+            # pushed events are applied as they arrive, in batches,
+            # while waiting for the next scan
+            while True:
+                wake.clear()
+                try:
+                    while scanner.drain_events():
+                        await asyncio.sleep(0)  # let other scanners run
+                except Exception:
+                    LOG.exception(f"{name} failed to handle pushed events")
+                timeout = None  # push only plugins wait for events
+                if scanner.supports_scan:
+                    # the interval may shrink while waiting, eg. on a burst request
+                    timeout = scanner.next_scan_time - time.time()
+                    if timeout <= 0:
+                        break
+                try:
+                    await asyncio.wait_for(wake.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _scan_once(self, name, scanner, handle_results):
+        start = time.monotonic()
+        try:
+            results = await self._scan(scanner)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            LOG.exception(f"{name} scan failed")
+            scanner.metrics.incr(f"scanner.{scanner.name}.errors")
+            results = []
+        scanner.record_scan_duration(time.monotonic() - start)
+        try:
+            handle_results(results)
+        except Exception:
+            LOG.exception(f"{name} failed to handle scan results")
+
+    async def _expiry_loop(self, name, scanner):
+        # loss detection runs independently of scans, so a slow scan
+        # does not delay lost device events
+        while True:
+            try:
+                scanner.check_lost_devices()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                LOG.exception(f"{name} loss detection failed")
+            # new entries always expire at least ttl from now
+            delay = scanner.ttl
+            if scanner.next_expiry is not None:
+                delay = min(delay, max(0.0, scanner.next_expiry - time.time()))
+            await asyncio.sleep(delay)
@@ -26,10 +26,14 @@ class CommonIOTService(PHALPlugin):
         """
         super().__init__(bus=bus, name="ovos-PHAL-plugin-iot", config=config)
         self.bus = bus
-        self.vui = IOTVoiceInterface(self.bus)
-        self.device_manager = CommonIOTDeviceManager(self.bus)
+        self.device_manager = CommonIOTDeviceManager(self.bus, self.config)
+        self.vui = IOTVoiceInterface(self.bus, self.device_manager)
         self.device_manager.load_scanners()
 
+    def shutdown(self):
+        self.device_manager.shutdown()
+        super().shutdown()
+
     @classproperty
     def runtime_requirements(self):
         return RuntimeRequirements(internet_before_load=False,
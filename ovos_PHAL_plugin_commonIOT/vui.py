@@ -2,6 +2,24 @@ from ovos_workshop.app import OVOSAbstractApplication
 
 
 class IOTVoiceInterface(OVOSAbstractApplication):
-    def __init__(self, bus=None):
+    def __init__(self, bus=None, device_manager=None):
         super().__init__(skill_id="ovos.iot", bus=bus)
+        self.device_manager = device_manager
         # TODO - pretend this is a skill and implement intents
+
+    def resolve_device(self, phrase):
+        """ best matching device for a spoken name, eg. "kitchen lamp",
+        None if nothing matches well enough"""
+        if self.device_manager is None:
+            return None
+        matches = self.device_manager.find_devices(phrase, k=1)
+        if not matches:
+            return None
+        return matches[0][0]
+
+    def available_capabilities(self, area=None):
+        """ IOTCapabilties of at least one known device,
+        intents for anything else do not apply"""
+        if self.device_manager is None:
+            return set()
+        return self.device_manager.get_capabilities(area)
@@ -0,0 +1,93 @@
+import unittest
+
+from ovos_PHAL_plugin_commonIOT.opm.base import IOTAbstractDevice
+from ovos_PHAL_plugin_commonIOT.opm.commands import DeviceCommandQueue
+
+
+class FakeDispatcher:
+    def __init__(self):
+        self.scheduled = []
+
+    def schedule(self, command_queue, due):
+        self.scheduled.append((command_queue, due))
+
+
+class FakeDevice:
+    device_id = "fake"
+    bus_actions = IOTAbstractDevice.bus_actions
+
+    def __init__(self):
+        self.calls = []
+
+    def __getattr__(self, action):
+        return lambda *args, **kwargs: self.calls.append((action, args))
+
+
+class TestDeviceCommandQueue(unittest.TestCase):
+    def setUp(self):
+        self.device = FakeDevice()
+        self.dispatcher = FakeDispatcher()
+        self.queue = DeviceCommandQueue(self.device, min_interval=0,
+                                        dispatcher=self.dispatcher)
+
+    def flush(self):
+        while len(self.queue):
+            self.queue._send_next()
+        return self.device.calls
+
+    def test_toggles_cancel_out(self):
+        self.queue.submit("toggle")
+        self.queue.submit("toggle")
+        self.assertEqual(len(self.queue), 0)
+        self.assertEqual(self.queue.merged, 2)
+        self.assertEqual(self.flush(), [])
+
+    def test_three_toggles_leave_one(self):
+        for _ in range(3):
+            self.queue.submit("toggle")
+        self.assertEqual(self.flush(), [("toggle", ())])
+
+    def test_turn_on_then_toggle_is_turn_off(self):
+        self.queue.submit("turn_on")
+        self.queue.submit("toggle")
+        self.assertEqual(self.flush(), [("turn_off", ())])
+
+    def test_turn_off_then_toggle_is_turn_on(self):
+        self.queue.submit("turn_off")
+        self.queue.submit("toggle")
+        self.assertEqual(self.flush(), [("turn_on", ())])
+
+    def test_power_replaces_pending_toggle(self):
+        self.queue.submit("toggle")
+        self.queue.submit("turn_on")
+        self.assertEqual(self.flush(), [("turn_on", ())])
+
+    def test_last_brightness_wins(self):
+        self.queue.submit("change_brightness", 10)
+        self.queue.submit("set_low_brightness")
+        self.queue.submit("change_brightness", 80)
+        self.assertEqual(self.flush(), [("change_brightness", (80,))])
+        self.assertEqual(self.queue.merged, 2)
+
+    def test_kinds_keep_submission_order(self):
+        self.queue.submit("turn_on")
+        self.queue.submit("change_color", "red")
+        self.queue.submit("change_brightness", 50)
+        self.assertEqual(self.flush(), [("turn_on", ()),
+                                        ("change_color", ("red",)),
+                                        ("change_brightness", (50,))])
+
+    def test_unknown_actions_never_merge(self):
+        self.queue.submit("reboot")
+        self.queue.submit("reboot")
+        self.assertEqual(self.flush(), [("reboot", ()), ("reboot", ())])
+
+    def test_scheduled_once_while_pending(self):
+        self.queue.submit("turn_on")
+        self.queue.submit("change_brightness", 50)
+        self.assertEqual(len(self.dispatcher.scheduled), 1)
+
+    def test_only_device_actions_are_queued(self):
+        with self.assertRaises(ValueError):
+            self.queue.submit("__setattr__", "_host", "attacker")
+        self.assertEqual(len(self.queue), 0)
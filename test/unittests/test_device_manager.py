@@ -0,0 +1,126 @@
+import unittest
+
+from ovos_utils.fakebus import FakeBus
+
+from ovos_PHAL_plugin_commonIOT.device_manager import CommonIOTDeviceManager
+from ovos_PHAL_plugin_commonIOT.opm.base import Switch
+from ovos_PHAL_plugin_commonIOT.opm.ratelimit import get_rate_limiter
+from ovos_PHAL_plugin_commonIOT.registry import device_from_record
+
+
+class CountingSwitch(Switch):
+    __slots__ = ("sent",)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sent = []
+
+    def turn_on(self):
+        self.sent.append("turn_on")
+        return True
+
+
+class TestDeviceActions(unittest.TestCase):
+    def setUp(self):
+        get_rate_limiter().configure({"rate": 0})
+        self.manager = CommonIOTDeviceManager(FakeBus(), {"persist_devices": False})
+        self.device = CountingSwitch("a", "10.0.0.5")
+        self.device._provisional = False
+        self.manager.on_new_device(self.device, "lan")
+
+    def tearDown(self):
+        self.manager.shutdown()
+        get_rate_limiter().configure({})
+
+    def test_allowed_action(self):
+        self.assertEqual(self.manager.call_device("a", "turn_on"),
+                         {"device_id": "a", "result": True})
+        self.assertEqual(self.device.sent, ["turn_on"])
+
+    def test_private_attributes_are_not_callable(self):
+        for action in ("__setattr__", "__init__", "from_record", "start_effect",
+                       "invalidate_state"):
+            result = self.manager.call_device("a", action, "_host", "attacker")
+            self.assertEqual(result["error"], f"{action} not allowed")
+        self.assertEqual(self.device.host, "10.0.0.5")
+
+    def test_group_call_rejects_private_attributes(self):
+        results = self.manager.group_call(["a"], "__setattr__", "_host", "attacker")
+        self.assertIn("error", results["a"])
+        self.assertEqual(self.device.host, "10.0.0.5")
+
+    def test_unknown_device(self):
+        self.assertEqual(self.manager.call_device("missing", "turn_on")["error"],
+                         "device not found")
+
+    def test_queue_command_rejects_private_attributes(self):
+        result = self.manager.queue_command("a", "__setattr__", "_host", "attacker")
+        self.assertEqual(result["error"], "__setattr__ not allowed")
+        self.assertEqual(len(self.device.commands), 0)
+
+    def test_restored_devices_refuse_commands(self):
+        record = dict(self.device.as_record(), device_id="b", module="missing")
+        restored = device_from_record(record)
+        self.manager.on_new_device(restored, "lan")
+        self.assertTrue(restored.is_provisional)
+        self.assertEqual(self.manager.call_device("b", "turn_on")["error"],
+                         "device not confirmed yet")
+        self.assertEqual(self.manager.queue_command("b", "turn_on")["error"],
+                         "device not confirmed yet")
+        # confirmed by the next scan
+        confirmed = CountingSwitch("b", "10.0.0.5")
+        self.manager.on_new_device(confirmed, "lan")
+        self.assertEqual(self.manager.call_device("b", "turn_on")["result"], True)
+
+
+class TestSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.manager = CommonIOTDeviceManager(FakeBus(), {"persist_devices": False})
+        self.serialized = []
+        serialize = self.manager._serialize
+
+        def counting_serialize(device):
+            # device reads must not happen under the manager lock
+            self.assertFalse(self.manager.lock._is_owned())
+            self.serialized.append(device.device_id)
+            return serialize(device)
+
+        self.manager._serialize = counting_serialize
+        for dev_id in ("c", "a", "b"):
+            self.manager.on_new_device(Switch(dev_id, f"host-{dev_id}"), "lan")
+
+    def tearDown(self):
+        self.manager.shutdown()
+
+    def ids(self):
+        return [d["device_id"] for d in self.manager.get_snapshot()[1]]
+
+    def test_sorted_and_cached(self):
+        self.assertEqual(self.ids(), ["a", "b", "c"])
+        self.assertEqual(sorted(self.serialized), ["a", "b", "c"])
+        self.serialized.clear()
+        self.assertEqual(self.ids(), ["a", "b", "c"])
+        self.assertEqual(self.serialized, [])
+
+    def test_only_changed_devices_are_serialized(self):
+        self.ids()
+        self.serialized.clear()
+        device = self.manager.devices["b"]
+        device.remember_state("is_on", True)
+        device.remember_state("is_on", False)
+        self.assertEqual(self.ids(), ["a", "b", "c"])
+        self.assertEqual(self.serialized, ["b"])
+
+    def test_added_and_lost_devices(self):
+        self.ids()
+        self.serialized.clear()
+        self.manager.on_device_lost(self.manager.devices["a"])
+        self.manager.on_new_device(Switch("d", "host-d"), "lan")
+        self.assertEqual(self.ids(), ["b", "c", "d"])
+        self.assertEqual(self.serialized, ["d"])
+
+    def test_previous_snapshot_is_not_modified(self):
+        version, devices = self.manager.get_snapshot()
+        self.manager.on_new_device(Switch("d", "host-d"), "lan")
+        self.assertGreater(self.manager.get_snapshot()[0], version)
+        self.assertEqual([d["device_id"] for d in devices], ["a", "b", "c"])
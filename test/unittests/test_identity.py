@@ -0,0 +1,91 @@
+import unittest
+
+from ovos_PHAL_plugin_commonIOT.identity import DeviceIdentityGraph
+
+
+class TestDeviceIdentityGraph(unittest.TestCase):
+    def setUp(self):
+        self.graph = DeviceIdentityGraph()
+
+    def test_strong_signal_merges(self):
+        self.graph.add("tv-lan", {"mac": "aa:bb"}, scanner="lan")
+        self.graph.add("tv-upnp", {"mac": "aa:bb"}, scanner="upnp")
+        self.assertEqual(self.graph.group("tv-upnp"), ["tv-lan", "tv-upnp"])
+        self.assertEqual(self.graph.canonical_id("tv-upnp"), "tv-lan")
+
+    def test_weak_signal_merges_across_scanners(self):
+        self.graph.add("tv-lan", {"host": "10.0.0.5"}, scanner="lan")
+        self.graph.add("tv-vendor", {"host": "10.0.0.5"}, scanner="vendor")
+        self.assertEqual(self.graph.group("tv-lan"), ["tv-lan", "tv-vendor"])
+
+    def test_hub_children_are_not_merged(self):
+        self.graph.add("hue-1", {"host": "10.0.0.9"}, scanner="hue")
+        self.graph.add("hue-2", {"host": "10.0.0.9"}, scanner="hue")
+        self.assertEqual(self.graph.group("hue-1"), ["hue-1"])
+        self.assertEqual(self.graph.group("hue-2"), ["hue-2"])
+
+    def test_lost_member_leaves_group(self):
+        self.graph.add("tv-lan", {"mac": "aa:bb"}, scanner="lan")
+        self.graph.add("tv-upnp", {"mac": "aa:bb"}, scanner="upnp")
+        self.graph.remove("tv-lan")
+        self.assertEqual(self.graph.group("tv-upnp"), ["tv-upnp"])
+        # the canonical id is kept while the group exists
+        self.assertEqual(self.graph.canonical_id("tv-upnp"), "tv-lan")
+        self.assertIn("tv-lan", self.graph)
+
+    def test_group_pruned_once_every_member_is_lost(self):
+        self.graph.add("tv-lan", {"mac": "aa:bb", "host": "10.0.0.5"}, scanner="lan")
+        self.graph.add("tv-upnp", {"mac": "aa:bb"}, scanner="upnp")
+        self.graph.remove("tv-lan")
+        self.graph.remove("tv-upnp")
+        self.assertNotIn("tv-lan", self.graph)
+        self.assertNotIn("tv-upnp", self.graph)
+        self.assertEqual(self.graph.group("tv-lan"), [])
+        self.assertEqual(self.graph._strong, {})
+        self.assertEqual(self.graph._weak, {})
+        self.assertEqual(self.graph._keys, {})
+
+    def test_pruned_signals_do_not_merge_new_devices(self):
+        self.graph.add("old", {"mac": "aa:bb"}, scanner="lan")
+        self.graph.remove("old")
+        self.graph.add("new", {"mac": "aa:bb"}, scanner="lan")
+        self.assertEqual(self.graph.group("new"), ["new"])
+        self.assertEqual(self.graph.canonical_id("new"), "new")
+
+    def test_remove_unknown_device(self):
+        self.graph.remove("missing")
+        self.assertNotIn("missing", self.graph)
+
+    def test_readdressed_device_releases_old_host(self):
+        self.graph.add("A", {"host": "10.0.0.5"}, scanner="lan")
+        self.graph.add("A", {"host": "10.0.0.6"}, scanner="lan")
+        self.graph.add("C", {"host": "10.0.0.5"}, scanner="vendor")
+        self.assertEqual(self.graph.group("C"), ["C"])
+        self.assertEqual(self.graph.group("A"), ["A"])
+
+    def test_readdressed_device_is_split_from_its_group(self):
+        self.graph.add("A", {"host": "10.0.0.5"}, scanner="lan")
+        self.graph.add("B", {"host": "10.0.0.5"}, scanner="vendor")
+        self.assertEqual(self.graph.group("A"), ["A", "B"])
+        self.graph.add("A", {"host": "10.0.0.6"}, scanner="lan")
+        self.assertEqual(self.graph.group("A"), ["A"])
+        self.assertEqual(self.graph.group("B"), ["B"])
+        self.assertEqual(self.graph.canonical_id("B"), "B")
+        # the new address joins the device that moved there
+        self.graph.add("D", {"host": "10.0.0.6"}, scanner="vendor")
+        self.assertEqual(self.graph.group("A"), ["A", "D"])
+
+    def test_readdressed_device_keeps_strong_merges(self):
+        self.graph.add("A", {"host": "10.0.0.5", "mac": "aa:bb"}, scanner="lan")
+        self.graph.add("B", {"mac": "aa:bb"}, scanner="vendor")
+        self.graph.add("A", {"host": "10.0.0.6", "mac": "aa:bb"}, scanner="lan")
+        self.assertEqual(self.graph.group("A"), ["A", "B"])
+        self.assertEqual(self.graph.canonical_id("B"), "A")
+
+    def test_strong_signal_handed_over_when_released(self):
+        self.graph.add("A", {"mac": "aa:bb"}, scanner="lan")
+        self.graph.add("B", {"mac": "aa:bb"}, scanner="vendor")
+        self.graph.add("A", {"mac": "cc:dd"}, scanner="lan")
+        self.assertEqual(self.graph.group("A"), ["A"])
+        self.graph.add("C", {"mac": "aa:bb"}, scanner="ble")
+        self.assertEqual(self.graph.group("C"), ["B", "C"])
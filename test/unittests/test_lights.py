@@ -0,0 +1,54 @@
+import time
+import unittest
+
+from lingua_franca.util.colors import Color
+
+from ovos_PHAL_plugin_commonIOT.opm.colors import COLOR_WHEEL, resolve_color
+from ovos_PHAL_plugin_commonIOT.opm.lights import RGBBulb
+from ovos_PHAL_plugin_commonIOT.opm.ratelimit import get_rate_limiter
+
+
+class FakeRGBBulb(RGBBulb):
+    __slots__ = ("colors",)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.colors = []
+
+    @property
+    def is_on(self):
+        return True
+
+    def change_color(self, color="white"):
+        # plugins receive Color objects
+        self.colors.append(color.rgb255)
+
+
+class TestColors(unittest.TestCase):
+    def test_resolved_colors_are_copies(self):
+        color = resolve_color("red")
+        color.hue = 0.5
+        self.assertEqual(resolve_color("red").rgb255, (255, 0, 0))
+
+
+class TestRGBBulb(unittest.TestCase):
+    def setUp(self):
+        get_rate_limiter().configure({"rate": 0})
+        self.bulb = FakeRGBBulb("rgb", "10.0.0.7")
+
+    def tearDown(self):
+        self.bulb.stop_effect()
+        get_rate_limiter().configure({})
+
+    def test_color_cycle_sends_colors(self):
+        self.bulb.color_cycle(color_time=0.01)
+        deadline = time.monotonic() + 2
+        while len(self.bulb.colors) < 3 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.bulb.colors[:3],
+                         [resolve_color(c).rgb255 for c in COLOR_WHEEL[:3]])
+
+    def test_change_color_rgb_sends_color(self):
+        self.bulb.change_color_rgb(0, 255, 0)
+        self.assertEqual(self.bulb.colors, [(0, 255, 0)])
+        self.assertIsInstance(self.bulb.color, Color)
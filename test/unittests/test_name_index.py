@@ -0,0 +1,27 @@
+import unittest
+
+from ovos_PHAL_plugin_commonIOT.name_index import DeviceNameIndex, trigrams
+
+
+class TestDeviceNameIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = DeviceNameIndex()
+        self.index.add("k", ["kitchen lamp"])
+        self.index.add("b", ["bedroom light"])
+
+    def test_dice_coefficient_of_trigrams(self):
+        a, b = trigrams("kichen"), trigrams("kitchen")
+        expected = 2 * len(a & b) / (len(a) + len(b))
+        self.assertAlmostEqual(self.index._match_word("kichen")["kitchen"], expected)
+        self.assertAlmostEqual(expected, 0.62, places=2)
+
+    def test_exact_match(self):
+        self.assertEqual(self.index.lookup("the kitchen lamp")[0], ("k", 1.0))
+
+    def test_misheard_word(self):
+        self.assertEqual(self.index.lookup("kichen lamp")[0][0], "k")
+
+    def test_removed_words_are_forgotten(self):
+        self.index.remove("k")
+        self.assertEqual(self.index._match_word("kichen"), {})
+        self.assertNotIn("kitchen", self.index._gram_counts)
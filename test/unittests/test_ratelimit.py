@@ -0,0 +1,97 @@
+import unittest
+
+from ovos_PHAL_plugin_commonIOT.opm.base import Switch
+from ovos_PHAL_plugin_commonIOT.opm.ratelimit import HostRateLimiter, \
+    RateLimitExceeded, TokenBucket, get_rate_limiter, nonblocking
+
+
+class CountingSwitch(Switch):
+    __slots__ = ("sent",)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sent = 0
+
+    def turn_on(self):
+        self.sent += 1
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_burst_then_wait(self):
+        bucket = TokenBucket(rate=10, burst=2)
+        self.assertEqual(bucket.reserve(max_wait=1), 0)
+        self.assertEqual(bucket.reserve(max_wait=1), 0)
+        self.assertAlmostEqual(bucket.reserve(max_wait=1), 0.1, places=2)
+
+    def test_rejected_token_is_given_back(self):
+        bucket = TokenBucket(rate=1, burst=1)
+        self.assertEqual(bucket.reserve(max_wait=0.5), 0)
+        self.assertIsNone(bucket.reserve(max_wait=0.5))
+        self.assertIsNone(bucket.reserve(max_wait=0.5))
+        self.assertAlmostEqual(bucket.tokens, 0, places=2)
+
+    def test_try_take_never_borrows(self):
+        bucket = TokenBucket(rate=2, burst=1)
+        self.assertEqual(bucket.try_take(), 0)
+        self.assertAlmostEqual(bucket.try_take(), 0.5, places=2)
+        self.assertAlmostEqual(bucket.tokens, 0, places=2)
+
+
+class TestHostRateLimiter(unittest.TestCase):
+    def test_acquire_rejects_beyond_max_wait(self):
+        limiter = HostRateLimiter({"rate": 1, "burst": 1, "max_wait": 0})
+        device = Switch("a", "h1")
+        limiter.acquire(device, "h1")
+        with self.assertRaises(RateLimitExceeded):
+            limiter.acquire(device, "h1")
+        # other hosts have their own bucket
+        limiter.acquire(device, "h2")
+
+    def test_try_acquire_does_not_block(self):
+        limiter = HostRateLimiter({"rate": 1, "burst": 1})
+        device = Switch("a", "h1")
+        self.assertEqual(limiter.try_acquire(device, "h1"), 0)
+        self.assertGreater(limiter.try_acquire(device, "h1"), 0)
+
+    def test_disabled(self):
+        limiter = HostRateLimiter({"rate": 0})
+        self.assertFalse(limiter.enabled)
+        for _ in range(100):
+            limiter.acquire(Switch("a", "h1"), "h1")
+
+    def test_class_and_host_limits(self):
+        limiter = HostRateLimiter({"rate": 0,
+                                   "classes": {"CountingSwitch": {"rate": 5}},
+                                   "hosts": {"h2": {"rate": 7}}})
+        self.assertEqual(limiter._limits(CountingSwitch("a", "h1"), "h1")[0], 5)
+        self.assertEqual(limiter._limits(CountingSwitch("b", "h2"), "h2")[0], 7)
+        self.assertEqual(limiter._limits(Switch("c", "h3"), "h3")[0], 0)
+
+
+class TestRateLimitedActions(unittest.TestCase):
+    def setUp(self):
+        get_rate_limiter().configure({"rate": 1, "burst": 1, "max_wait": 0})
+
+    def tearDown(self):
+        get_rate_limiter().configure({})
+
+    def test_action_rejected(self):
+        device = CountingSwitch("a", "h1")
+        device.turn_on()
+        with self.assertRaises(RateLimitExceeded):
+            device.turn_on()
+        self.assertEqual(device.sent, 1)
+
+    def test_nonblocking_drops_instead_of_raising(self):
+        device = CountingSwitch("a", "h1")
+        device.turn_on()
+        with nonblocking():
+            self.assertIsNone(device.turn_on())
+        self.assertEqual(device.sent, 1)
+
+    def test_nonblocking_device_uses_reserved_token(self):
+        device = CountingSwitch("a", "h1")
+        device.turn_on()
+        with nonblocking(device):
+            device.turn_on()
+        self.assertEqual(device.sent, 2)
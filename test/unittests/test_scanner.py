@@ -0,0 +1,68 @@
+import unittest
+
+from ovos_utils.fakebus import FakeBus
+
+from ovos_PHAL_plugin_commonIOT.opm.base import IOTScanEvent, IOTScannerPlugin, Switch
+
+
+class FakeScanner(IOTScannerPlugin):
+    def scan(self):
+        return []
+
+
+class TestLossDetection(unittest.TestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.found = []
+        self.lost = []
+        self.scanner = FakeScanner(
+            FakeBus(), "fake", {"ttl": 10},
+            new_device_callback=lambda d: self.found.append(d.device_id),
+            lost_device_callback=lambda d: self.lost.append(d.device_id))
+        self.scanner.clock = lambda: self.now
+
+    def scan(self, *device_ids):
+        self.scanner.handle_scan_results([Switch(d, "h") for d in device_ids])
+
+    def check(self, now):
+        self.now = now
+        self.scanner.check_lost_devices()
+
+    def test_lost_after_ttl(self):
+        self.scan("a")
+        self.check(9)
+        self.assertEqual(self.lost, [])
+        self.check(10)
+        self.assertEqual(self.lost, ["a"])
+        self.assertEqual(self.scanner.next_expiry, None)
+
+    def test_seen_again_is_rescheduled(self):
+        self.scan("a")
+        self.now = 5
+        self.scan("a")
+        self.check(10)
+        self.assertEqual(self.lost, [])
+        self.assertEqual(self.scanner.next_expiry, 15)
+        self.check(15)
+        self.assertEqual(self.lost, ["a"])
+
+    def test_stale_entry_of_removed_device_is_skipped(self):
+        self.scan("a")
+        # removed by a delta scan, its heap entry for t=10 stays behind
+        self.scanner.handle_scan_delta([(IOTScanEvent.REMOVED, Switch("a", "h"))])
+        self.assertEqual(self.lost, ["a"])
+        self.now = 1
+        self.scan("a")
+        self.check(10)
+        self.assertEqual(self.lost, ["a"])
+        self.check(11)
+        self.assertEqual(self.lost, ["a", "a"])
+        self.assertEqual(self.found, ["a", "a"])
+
+    def test_only_due_entries_are_checked(self):
+        self.scan("a")
+        self.now = 8
+        self.scan("b")
+        self.check(10)
+        self.assertEqual(self.lost, ["a"])
+        self.assertEqual(self.scanner.next_expiry, 18)